@@ -0,0 +1,333 @@
+# Benchmarks for the equation, EOS and normalization hot paths.
+#
+#   python bench.py                          run all, print table
+#   python bench.py -o results.json          also write results as JSON
+#   python bench.py --save baseline.json     store results as baseline
+#   python bench.py --compare baseline.json  compare with stored baseline,
+#                                            exit status 1 on regressions
+#
+# Every benchmark is timed for --repeat rounds of a number of calls that is
+# calibrated to take at least --min-time seconds. The minimum time per call
+# over the rounds is the figure used for comparisons.
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import physconst as pc
+import norm
+import eos
+import ufo_parameters as up
+import ufo_kernels as uk
+import ufo_parallel
+import ufo_refine
+import ufo_timeseries
+
+# Registered benchmarks: name -> function(n) returning the callable to time.
+# A close() attribute of the callable is called after timing, to release
+# resources such as worker pools.
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def batch_inputs(n, seed=42):
+    """
+    Reproducible batch of n UfoParams input parameter sets.
+    """
+    rng = np.random.default_rng(seed)
+    return dict(power=10 ** rng.uniform(42., 46., n),
+                speed=rng.uniform(0.01, 0.3, n),
+                mdot=10 ** rng.uniform(-2., 1., n),
+                rufo=rng.uniform(0.01, 0.2, n),
+                dens_ambient=10 ** rng.uniform(-2., 2., n),
+                temp_ambient=10 ** rng.uniform(6., 8., n))
+
+
+@benchmark('physnorm_init')
+def _(n):
+    return lambda: norm.PhysNorm(x=pc.kpc, t=pc.kyr, dens=0.6165 * pc.amu, temp=1.e7, curr=1)
+
+
+@benchmark('ufoparams_init_scalar')
+def _(n):
+    return lambda: up.UfoParams()
+
+
+@benchmark('ufoparams_init_batch')
+def _(n):
+    params = batch_inputs(n)
+    return lambda: up.UfoParams(**params)
+
+
+@benchmark('update_all_scalar')
+def _(n):
+    return up.UfoParams().update_all
+
+
+@benchmark('update_all_batch')
+def _(n):
+    return up.UfoParams(**batch_inputs(n)).update_all
+
+
+@benchmark('update_dictionary_cgs_batch')
+def _(n):
+    return up.UfoParams(**batch_inputs(n)).update_dictionary_cgs
+
+
+def _register_eqns():
+    for var in up.UfoParams().defs:
+        eqn = 'eqn_' + var
+        if not hasattr(up.UfoParams, eqn):
+            continue
+
+        def scalar(n, eqn=eqn):
+            return getattr(up.UfoParams(), eqn)
+
+        def batch(n, eqn=eqn):
+            return getattr(up.UfoParams(**batch_inputs(n)), eqn)
+
+        benchmark(eqn + '_scalar')(scalar)
+        benchmark(eqn + '_batch')(batch)
+
+
+_register_eqns()
+
+
+def _register_eos():
+    nrm = up.default_norm()
+    e = eos.EOSIdeal(comp=up.CompositionUfo(), inorm=nrm, onorm=nrm)
+    rng = np.random.default_rng(0)
+    conversions = [('pres_from_dens_temp', 'dens', 'temp'),
+                   ('dens_from_pres_temp', 'pres', 'temp'),
+                   ('temp_from_dens_pres', 'dens', 'pres')]
+    for conv, a, b in conversions:
+
+        def scalar(n, conv=conv):
+            fn = getattr(e, conv)
+            return lambda: fn(1., 1.)
+
+        def batch(n, conv=conv):
+            fn = getattr(e, conv)
+            v1, v2 = rng.uniform(0.1, 10., n), rng.uniform(0.1, 10., n)
+            return lambda: fn(v1, v2)
+
+        benchmark('eos_' + conv + '_scalar')(scalar)
+        benchmark('eos_' + conv + '_batch')(batch)
+
+
+_register_eos()
+
+
+@benchmark('ufoparamsrel_init_batch')
+def _(n):
+    params = batch_inputs(n)
+    return lambda: up.UfoParamsRel(**params)
+
+
+@benchmark('eos_tm_prim_from_cons_batch')
+def _(n):
+    p = up.UfoParamsRel(**batch_inputs(n))
+    return lambda: p.eost.prim_from_cons(p.cons_dens, p.cons_mom, p.cons_ener)
+
+
+@benchmark('eos_tm_roundtrip_cold')
+def _(n):
+    # Cold states, where the pressure is a tiny part of the energy, with
+    # bulk speeds of up to the sound speed. The round trip must keep the
+    # pressure to rounding error.
+    rng = np.random.default_rng(42)
+    e = eos.EOSTaubMatthews()
+    dens = 10 ** rng.uniform(-28., -22., n)
+    theta = 10 ** rng.uniform(-14., -4., n)
+    v = rng.uniform(-1., 1., n) * np.sqrt(theta) * pc.c
+    pres = theta * dens * pc.c ** 2
+    cons = e.cons_from_prim(dens, v, pres)
+    prim = e.prim_from_cons(*cons)
+    err = max(np.max(np.abs(p / q - 1.)) for p, q in zip(prim, (dens, v, pres)))
+    if not err < 1.e-12:
+        raise RuntimeError('Round trip of cold states loses accuracy, relative error ' + str(err) + '.')
+    return lambda: e.cons_from_prim(*e.prim_from_cons(*cons))
+
+
+@benchmark('kernel_evaluate_batch')
+def _(n):
+    k = uk.Kernel()
+    params = batch_inputs(n)
+    out = k.new_output(n)
+    return lambda: k.evaluate(out, **params)
+
+
+def _register_threads():
+    # Scaling of threaded evaluation from 1 to all available threads
+    nmax = ufo_parallel.default_threads()
+    nthreads = [1]
+    while nthreads[-1] * 2 < nmax:
+        nthreads.append(nthreads[-1] * 2)
+    if nmax > 1: nthreads.append(nmax)
+
+    for nt in nthreads:
+
+        def threaded(n, nt=nt):
+            k = ufo_parallel.ThreadedKernel(nthreads=nt)
+            params = batch_inputs(n)
+            out = k.new_output(n)
+
+            def fn():
+                return k.evaluate(out, **params)
+
+            fn.close = k.close
+            return fn
+
+        benchmark('threaded_evaluate_batch_t' + str(nt))(threaded)
+
+
+_register_threads()
+
+
+@benchmark('timeseries_blocks')
+def _(n):
+    ts = ufo_timeseries.TimeSeries(n=n, dt=1.e-3, power=lambda t: 1.e44 * (1. + np.sin(t)))
+
+    def fn():
+        for t, out in ts.blocks():
+            pass
+
+    return fn
+
+
+@benchmark('refine_power_speed')
+def _(n):
+    ranges = OrderedDict([('power', (1.e42, 1.e46, 'log')), ('speed', (1.e-4, 0.3, 'log'))])
+    return lambda: ufo_refine.refine(ranges, base=4, max_level=6, temp_ambient=1.e8)
+
+
+@benchmark('print_all')
+def _(n):
+    p = up.UfoParams()
+
+    def fn():
+        with contextlib.redirect_stdout(io.StringIO()):
+            p.print_all()
+
+    return fn
+
+
+def timeit(fn, repeat=5, min_time=0.1):
+    """
+    Time fn. Returns an OrderedDict of timing statistics per call (s).
+    """
+    # Calibrate number of calls per round
+    number = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        dt = time.perf_counter() - t0
+        if dt >= min_time or number >= 1 << 20:
+            break
+        number *= 2 if dt <= 0. else max(2, min(10, int(1.2 * min_time / dt) + 1))
+
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - t0) / number)
+
+    return OrderedDict([('min', min(times)), ('median', float(np.median(times))),
+                        ('max', max(times)), ('number', number), ('repeat', repeat)])
+
+
+def run(pattern=None, n=100000, repeat=5, min_time=0.1, verbose=True):
+    """
+    Run all benchmarks whose name contains pattern.
+    """
+    results = OrderedDict()
+    for name, setup in BENCHMARKS.items():
+        if pattern and pattern not in name:
+            continue
+        fn = setup(n)
+        try:
+            results[name] = timeit(fn, repeat, min_time)
+        finally:
+            if hasattr(fn, 'close'): fn.close()
+        if verbose:
+            print(format(name, '40s') + format(results[name]['min'], '>14.4e') + ' s', file=sys.stderr)
+
+    meta = OrderedDict([('python', platform.python_version()), ('numpy', np.__version__),
+                        ('platform', platform.platform()), ('machine', platform.machine()),
+                        ('batch_size', n), ('date', time.strftime('%Y-%m-%dT%H:%M:%S'))])
+    return OrderedDict([('meta', meta), ('results', results)])
+
+
+def compare(results, baseline, threshold=1.2):
+    """
+    Compare results with baseline. Returns a list of
+    (name, baseline time, time, ratio, regressed) tuples.
+    """
+    rows = []
+    for name, r in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        t_ref = baseline['results'][name]['min']
+        ratio = r['min'] / t_ref if t_ref > 0 else float('inf')
+        rows.append((name, t_ref, r['min'], ratio, ratio > threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the UfoParams hot paths.')
+    parser.add_argument('-k', '--filter', help='Only run benchmarks whose name contains this string.')
+    parser.add_argument('-n', '--batch-size', type=int, default=100000, help='Size of batch inputs.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timing rounds.')
+    parser.add_argument('--min-time', type=float, default=0.1, help='Minimum duration of a round (s).')
+    parser.add_argument('-o', '--output', help='Write results as JSON to this file.')
+    parser.add_argument('--save', metavar='BASELINE', help='Write results as a new baseline.')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare results with a stored baseline.')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='Slowdown ratio above which a benchmark counts as regressed.')
+    args = parser.parse_args(argv)
+
+    results = run(args.filter, args.batch_size, args.repeat, args.min_time)
+
+    for path in (args.output, args.save):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('batch_size') != args.batch_size:
+            print('Warning: baseline batch size ' + str(baseline['meta'].get('batch_size')) +
+                  ' differs from ' + str(args.batch_size) + '.', file=sys.stderr)
+        rows = compare(results, baseline, args.threshold)
+        regressed = [r for r in rows if r[4]]
+        print(format('benchmark', '40s') + format('baseline', '>14s') + format('current', '>14s') +
+              format('ratio', '>8s'))
+        for name, t_ref, t, ratio, bad in rows:
+            print(format(name, '40s') + format(t_ref, '>14.4e') + format(t, '>14.4e') +
+                  format(ratio, '>8.2f') + ('   REGRESSED' if bad else ''))
+        if regressed:
+            print(str(len(regressed)) + ' benchmark(s) regressed by more than a factor ' +
+                  str(args.threshold) + '.', file=sys.stderr)
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,5 @@
 import physconst as pc
+import numpy as np
 import norm
 
 class CompositionBase():
@@ -44,28 +45,45 @@ class IonizedISM(CompositionBase):
         CompositionBase.__init__(self, mu)
 
 
+_cgs_norm = None
+
+
+def cgs_norm():
+    """
+    Unit normalization (cgs in, cgs out), the default of the EOS classes.
+    Constructed on first use and shared.
+    """
+    global _cgs_norm
+    if _cgs_norm is None:
+        _cgs_norm = norm.PhysNorm(x=1., m=1., t=1., curr=1., temp=1.)
+    return _cgs_norm
+
+
 class EOSBase():
 
-    def __init__(self, dens=None, pres=None, temp=None, comp=IonizedISM(),
-                 inorm=norm.PhysNorm(x=1., m=1., t=1., curr=1., temp=1.),
-                 onorm=norm.PhysNorm(x=1., m=1., t=1., curr=1., temp=1.)):
+    def __init__(self, dens=None, pres=None, temp=None, comp=None, inorm=None, onorm=None):
         """
-        inorm      Normalization of input. 
-        onorm      Normalization of output.
+        inorm      Normalization of input. Default cgs.
+        onorm      Normalization of output. Default cgs.
         comp       Composition object (also defined in eos.py)
                    This is mainly to get the value of mu.
+                   Default IonizedISM().
 
         Variables are immediately converted to cgs internally with inorm. 
         Output is normalized with onorm.
         """
 
+        if comp is None: comp = IonizedISM()
+        if inorm is None: inorm = cgs_norm()
+        if onorm is None: onorm = cgs_norm()
+
         mu = comp.mu
 
         state_vars = ['dens', 'pres', 'temp', 'eint', 'enth', 'entr']
 
-        if dens != None: dens = dens*inorm.dens
-        if pres != None: pres = pres*inorm.pres
-        if temp != None: temp = temp*inorm.temp
+        if dens is not None: dens = dens*inorm.dens
+        if pres is not None: pres = pres*inorm.pres
+        if temp is not None: temp = temp*inorm.temp
 
         self.__dict__.update(locals()); del self.__dict__['self']
 
@@ -73,12 +91,10 @@ class EOSBase():
 
 class EOSIdeal(EOSBase):
 
-    def __init__(self, dens=None, pres=None, temp=None, comp=IonizedISM(),
-                 inorm=norm.PhysNorm(x=1., m=1., t=1., curr=1., temp=1.),
-                 onorm=norm.PhysNorm(x=1., m=1., t=1., curr=1., temp=1.)):
+    def __init__(self, dens=None, pres=None, temp=None, comp=None, inorm=None, onorm=None):
         """
-        inorm      Normalization of input. 
-        onorm      Normalization of output.
+        inorm      Normalization of input. Default cgs.
+        onorm      Normalization of output. Default cgs.
 
         Variables are immediately converted to cgs internally with inorm. 
         Output is normalized with onorm.
@@ -103,7 +119,7 @@ class EOSIdeal(EOSBase):
                     "dens_temp", ...
         """
 
-        if mu == None: mu = self.mu
+        if mu is None: mu = self.mu
 
         if mode == 'dens_pres':
             v3 = self.temp_from_dens_pres(v1, v2, mu)
@@ -122,19 +138,19 @@ class EOSIdeal(EOSBase):
         """
         Auto complete the last variable not. 
         """
-        if self.temp == None and self.dens and self.pres:
+        if self.temp is None and self.dens and self.pres:
             self.temp = self.temp_from_dens_pres()
             self.pres = self.pres/self.onorm.pres
             self.dens = self.dens/self.onorm.dens
             return self.temp
 
-        elif self.pres == None and self.dens and self.temp:
+        elif self.pres is None and self.dens and self.temp:
             self.pres = self.pres_from_dens_temp()
             self.temp = self.temp/self.onorm.temp
             self.dens = self.dens/self.onorm.dens
             return self.pres
 
-        elif self.dens == None and self.pres and self.temp:
+        elif self.dens is None and self.pres and self.temp:
             self.dens = self.dens_from_pres_temp()
             self.pres = self.pres/self.onorm.pres
             self.temp = self.temp/self.onorm.temp
@@ -153,9 +169,9 @@ class EOSIdeal(EOSBase):
         mu is considered a variable of the EOS.
         """
 
-        dens = self.dens if dens == None else dens*self.inorm.dens
-        temp = self.temp if temp == None else temp*self.inorm.temp
-        if mu == None: mu = self.mu
+        dens = self.dens if dens is None else dens*self.inorm.dens
+        temp = self.temp if temp is None else temp*self.inorm.temp
+        if mu is None: mu = self.mu
 
         return dens*temp*pc.kboltz/(mu*pc.amu)/self.onorm.pres
 
@@ -164,9 +180,9 @@ class EOSIdeal(EOSBase):
         Every calculation of dens uses this function. 
         mu is considered a variable of the EOS.
         """
-        pres = self.pres if pres == None else pres*self.inorm.pres
-        temp = self.temp if temp == None else temp*self.inorm.temp
-        if mu == None: mu = self.mu
+        pres = self.pres if pres is None else pres*self.inorm.pres
+        temp = self.temp if temp is None else temp*self.inorm.temp
+        if mu is None: mu = self.mu
 
         return mu*pc.amu*pres/(temp*pc.kboltz)/self.onorm.dens
 
@@ -175,11 +191,196 @@ class EOSIdeal(EOSBase):
         Every calculation of temp uses this function.
         mu is considered a variable of the EOS.
         """
-        dens = self.dens if dens == None else dens*self.inorm.dens
-        pres = self.pres if pres == None else pres*self.inorm.pres
-        if mu == None: mu = self.mu
+        dens = self.dens if dens is None else dens*self.inorm.dens
+        pres = self.pres if pres is None else pres*self.inorm.pres
+        if mu is None: mu = self.mu
 
         return mu*pc.amu*pres/(dens*pc.kboltz)/self.onorm.temp
 
 
 
+
+
+class EOSTaubMatthews(EOSIdeal):
+
+    def __init__(self, dens=None, pres=None, temp=None, comp=None, inorm=None, onorm=None):
+        """
+        Taub-Matthews equation of state of a relativistic ideal gas
+        (Mignone, Plewa & Bodo 2005), which interpolates between an
+        adiabatic index of 5/3 for cold and 4/3 for hot gas.
+
+        inorm      Normalization of input. Default cgs.
+        onorm      Normalization of output. Default cgs.
+
+        The relation of pressure, proper density and temperature is that
+        of the ideal gas, see EOSIdeal. The specific enthalpy h, in units
+        of c^2 and including the rest mass energy, is a function of
+        theta = pres/(dens c^2),
+
+            h = 5/2 theta + sqrt(9/4 theta^2 + 1).
+
+        All functions take scalars or arrays.
+        """
+
+        EOSIdeal.__init__(self, dens, pres, temp, comp, inorm, onorm)
+
+    def enth_from_theta(self, theta):
+        """
+        Dimensionless specific enthalpy h (in c^2) from theta.
+        """
+        return 2.5*theta + np.sqrt(2.25*theta*theta + 1.)
+
+    def theta_from_enth(self, enth):
+        """
+        Inverse of enth_from_theta(), theta from the dimensionless
+        specific enthalpy h, the root of 4 theta^2 - 5 h theta + h^2 - 1 = 0
+        with theta <= 2/5 h.
+        """
+        return (5.*enth - np.sqrt(9.*enth*enth + 16.))/8.
+
+    def theta_from_dens_pres(self, dens=None, pres=None):
+        """
+        theta = pres/(dens c^2), dimensionless.
+        """
+        dens = self.dens if dens is None else dens*self.inorm.dens
+        pres = self.pres if pres is None else pres*self.inorm.pres
+
+        return pres/(dens*pc.c*pc.c)
+
+    def enth_from_dens_pres(self, dens=None, pres=None):
+        """
+        Specific enthalpy h c^2, including the rest mass energy.
+        """
+        theta = self.theta_from_dens_pres(dens, pres)
+
+        return self.enth_from_theta(theta)*pc.c*pc.c/self.onorm.eint
+
+    def eint_from_dens_pres(self, dens=None, pres=None):
+        """
+        Specific internal energy, (h - 1 - theta) c^2.
+        """
+        theta = self.theta_from_dens_pres(dens, pres)
+
+        return (self.enth_from_theta(theta) - 1. - theta)*pc.c*pc.c/self.onorm.eint
+
+    def gamma_eff(self, theta):
+        """
+        Effective adiabatic index (h - 1)/(h - 1 - theta).
+        """
+        enth = self.enth_from_theta(theta)
+
+        return (enth - 1.)/(enth - 1. - theta)
+
+    def vsnd_from_dens_pres(self, dens=None, pres=None):
+        """
+        Relativistic sound speed,
+        cs^2 = theta/(3 h) (5 h - 8 theta)/(h - theta) c^2.
+        """
+        theta = self.theta_from_dens_pres(dens, pres)
+        enth = self.enth_from_theta(theta)
+
+        return np.sqrt(theta/(3.*enth)*(5.*enth - 8.*theta)/(enth - theta))*pc.c/self.onorm.v
+
+    def cons_from_prim(self, dens, v, pres):
+        """
+        Conserved variables (D, S, tau) from the proper density, speed and
+        pressure, the inverse of prim_from_cons(). tau is written in terms
+        of h - 1 and gamma - 1, so it keeps its relative accuracy in the
+        non-relativistic limit.
+        """
+        c2 = pc.c*pc.c
+        dens = np.asarray(dens*self.inorm.dens, dtype=float)
+        v = np.asarray(v*self.inorm.v, dtype=float)
+        pres = np.asarray(pres*self.inorm.pres, dtype=float)
+
+        theta = pres/(dens*c2)
+        beta2 = v*v/c2
+        lor = 1./np.sqrt(1. - beta2)
+        enth = self.enth_from_theta(theta)
+        hm1 = 2.5*theta + 2.25*theta*theta/(np.sqrt(2.25*theta*theta + 1.) + 1.)
+        lm1 = lor*lor*beta2/(lor + 1.)
+
+        cdens = lor*dens
+        smom = lor*lor*dens*enth*v
+        cener = dens*c2*(lor*lor*hm1 + lor*lm1) - pres
+
+        return (cdens/self.onorm.dens, smom/(self.onorm.dens*self.onorm.v), cener/self.onorm.pres)
+
+    def prim_from_cons(self, cdens, cmom, cener, tol=1.e-12, maxiter=50):
+        """
+        Primitive variables from conserved variables, for whole batches.
+
+        cdens      Lab frame density D = gamma dens.
+        cmom       Lab frame momentum density S = gamma^2 dens h v.
+        cener      Lab frame energy density without rest mass energy,
+                   tau = gamma^2 dens h c^2 - pres - D c^2.
+        tol        Relative tolerance of theta.
+        maxiter    Maximum number of Newton iterations.
+
+        Solves for theta directly, with vectorized Newton iterations over
+        all elements that have not converged yet. The residual is written
+        in terms of h - 1, gamma - 1 and tau/(D c^2), without differences
+        of numbers close to one, so the pressure keeps its relative
+        accuracy in the non-relativistic limit.
+
+        Returns (dens, v, pres), the proper density, speed and pressure.
+        States without internal energy get zero pressure. Where the kinetic
+        energy dominates, the pressure is only determined to the rounding
+        error of tau relative to the internal energy. Elements that do not
+        converge are nan.
+        """
+        c2 = pc.c*pc.c
+        cdens = np.asarray(cdens*self.inorm.dens, dtype=float)
+        smom = np.asarray(cmom*self.inorm.dens*self.inorm.v, dtype=float)
+        cener = np.asarray(cener*self.inorm.pres, dtype=float)
+        cdens, smom, cener = np.broadcast_arrays(cdens, smom, cener)
+
+        # Dimensionless conserved variables, eps = tau/(D c^2), s = S c/(D c^2)
+        eps = np.ravel(cener/(cdens*c2))
+        s = np.ravel(np.abs(smom)/(cdens*pc.c))
+
+        # Residual of the energy at theta, with h = h(theta) and
+        # gamma = sqrt(1 + (s/h)^2),
+        #   f = gamma h - theta/gamma - 1 - eps
+        #     = (gamma - 1) h + (h - 1) - theta/gamma - eps
+        # f grows with theta. The internal energy of the cold state of the
+        # same momentum, -f(0), gives the initial guess (exact for slow
+        # non-relativistic flows) and zero pressure where it is not positive.
+        q2 = s*s
+        eint = eps - q2/(np.sqrt(1. + q2) + 1.)
+        theta = np.where(eint > 0., eint/1.5, 0.)
+
+        ulp = np.finfo(float).eps
+        active = np.flatnonzero(eint > 0.)
+        for i in range(maxiter):
+            if active.size == 0:
+                break
+            ta, sa = theta[active], s[active]
+            root = np.sqrt(2.25*ta*ta + 1.)
+            enth = 2.5*ta + root
+            dh = 2.5 + 2.25*ta/root
+            q2 = (sa/enth)**2
+            lor = np.sqrt(1. + q2)
+            dlor = -q2*dh/(lor*enth)
+            f = q2/(lor + 1.)*enth + 2.5*ta + 2.25*ta*ta/(root + 1.) - ta/lor - eps[active]
+            df = dlor*enth + lor*dh - 1./lor + ta*dlor/(lor*lor)
+
+            tnew = ta - f/df
+            # Stay positive
+            tnew = np.maximum(tnew, 0.5*ta)
+            theta[active] = tnew
+            # Converged, or f at the rounding error of eps, where the
+            # kinetic energy dominates and theta is not better determined
+            active = active[(np.abs(tnew - ta) > tol*tnew) & (np.abs(f) > 4.*ulp*eps[active])]
+
+        theta[active] = np.nan
+        theta = theta.reshape(np.shape(cdens))
+        s = s.reshape(theta.shape)
+
+        enth = self.enth_from_theta(theta)
+        lor = np.sqrt(1. + (s/enth)**2)
+        dens = cdens/lor
+        pres = theta*dens*c2
+        v = np.sign(smom)*s/(lor*enth)*pc.c
+
+        return dens/self.onorm.dens, v/self.onorm.v, pres/self.onorm.pres
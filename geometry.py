@@ -0,0 +1,181 @@
+# Launch geometries of the ufo outflow.
+#
+# A geometry model gives the area of the outflow at launch as a function of
+# the ufo radius rufo. Models are created for one or an array of angles
+# (and widths), and precompute everything that only depends on those once,
+# so area() is a few multiplications that broadcast over arrays of radii.
+#
+# area() broadcasts the per-angle coefficients elementwise against rufo, as
+# UfoParams needs for batches of parameter sets. area_grid() gives the
+# outer product, angles by radii, and sweep() uses it to sweep the
+# area-dependent variables of a UfoParams object over launch geometries.
+
+from collections import OrderedDict
+
+import numpy as np
+
+import physconst as pc
+
+# UfoParams variables inversely proportional to the outflow area
+AREA_VARS = ('pres', 'dens', 'eflx', 'pflx', 'pratio', 'dratio')
+
+
+class GeometryBase():
+    """
+    Base class of launch geometries. Derived classes implement
+    precompute(), returning a dictionary of coefficients per angle, and
+    _area(), the area from these coefficients.
+    """
+
+    def __init__(self, angle, **kwargs):
+        """
+        angle           Angle (in degrees), scalar or array.
+        kwargs          Further parameters of the model, broadcast
+                        against angle.
+        """
+        self.angle = np.asarray(angle, dtype=float)
+        self.coef = OrderedDict((k, np.asarray(v, dtype=float))
+                                for k, v in self.precompute(np.radians(self.angle), **kwargs).items())
+        self.shape = np.broadcast_shapes(*[v.shape for v in self.coef.values()])
+
+    def precompute(self, angle, **kwargs):
+        raise NotImplementedError
+
+    def _area(self, rufo, xunit, coef):
+        raise NotImplementedError
+
+    def area(self, rufo, xunit=1.):
+        """
+        Outflow area for radius rufo, broadcast elementwise against the
+        angles of the model.
+
+        rufo            Ufo radius, scalar or array.
+        xunit           Length of the length unit of the model (kpc) in
+                        the units of rufo.
+        """
+        return self._area(rufo, xunit, self.coef)
+
+    def area_grid(self, rufo, xunit=1.):
+        """
+        Outflow area for every combination of the angles of the model and
+        the radii rufo. The result has shape self.shape + np.shape(rufo).
+        """
+        rufo = np.asarray(rufo, dtype=float)
+        expand = (Ellipsis,) + (None,) * rufo.ndim
+        return self._area(rufo, xunit, OrderedDict((k, v[expand]) for k, v in self.coef.items()))
+
+
+class SphericalCap(GeometryBase):
+    """
+    Spherical cap of polar (half opening) angle alpha whose base has the
+    radius rufo. Reduces to a disc for alpha = 0.
+    """
+
+    def __init__(self, angle=30.):
+        """
+        angle           Polar angle (in degrees).
+        """
+        GeometryBase.__init__(self, angle)
+
+    def precompute(self, alpha):
+        # Area of the cap is 2 pi (1 - cos a) (r / sin a)^2 = 2 pi r^2 / (1 + cos a)
+        return {'k': 2. * np.pi / (1. + np.cos(alpha))}
+
+    def _area(self, rufo, xunit, coef):
+        return coef['k'] * rufo * rufo
+
+
+class Disc(GeometryBase):
+    """
+    Flat disc of radius rufo. The area does not depend on the angle,
+    which only sets the shape of sweeps.
+    """
+
+    def __init__(self, angle=0.):
+        """
+        angle           Angle (in degrees), not used for the area.
+        """
+        GeometryBase.__init__(self, angle)
+
+    def precompute(self, alpha):
+        return {'k': np.full(np.shape(alpha), np.pi)}
+
+    def _area(self, rufo, xunit, coef):
+        return coef['k'] * rufo * rufo
+
+
+class Annulus(GeometryBase):
+    """
+    Annular launching region in the disc, centred on radius rufo, from
+    which the wind leaves at angle phi with the disc in a sheet of width
+    wufo perpendicular to the flow. The width projected onto the disc is
+    delta = wufo / sin(phi) and the annulus extends from r1 = rufo - delta/2
+    (but at least 0) to r2 = rufo + delta/2. The area is that of the
+    annulus projected perpendicular to the flow, pi (r2^2 - r1^2) sin(phi).
+    """
+
+    def __init__(self, angle=90., wufo=0.002):
+        """
+        angle           Angle with disc (in degrees).
+        wufo            Width of the outflow sheet (kpc), scalar or array
+                        broadcast against angle.
+        """
+        GeometryBase.__init__(self, angle, wufo=wufo)
+
+    def precompute(self, phi, wufo):
+        sin = np.sin(phi)
+        return {'sin': sin, 'halfdelta': 0.5 * np.asarray(wufo) / sin}
+
+    def _radii(self, rufo, xunit, coef):
+        halfdelta = coef['halfdelta'] * xunit
+        return np.maximum(rufo - halfdelta, 0.), rufo + halfdelta
+
+    def r1(self, rufo, xunit=1.):
+        """
+        Inner wind launching radius.
+        """
+        return self._radii(rufo, xunit, self.coef)[0]
+
+    def r2(self, rufo, xunit=1.):
+        """
+        Outer wind launching radius.
+        """
+        return self._radii(rufo, xunit, self.coef)[1]
+
+    def delta(self, xunit=1.):
+        """
+        Width of the outflow sheet projected onto the disc.
+        """
+        return 2. * self.coef['halfdelta'] * xunit
+
+    def _area(self, rufo, xunit, coef):
+        r1, r2 = self._radii(rufo, xunit, coef)
+        return np.pi * (r2 * r2 - r1 * r1) * coef['sin']
+
+
+def sweep(params, model, rufo=None, vars=AREA_VARS):
+    """
+    Sweep the area-dependent variables of a UfoParams object over launch
+    geometries. All of them are inversely proportional to the area, so
+    they are scaled from the values of params rather than recalculated.
+
+    params          UfoParams object with scalar parameters.
+    model           Geometry model, e.g. SphericalCap(np.linspace(0, 80, 81)).
+    rufo            Ufo radii (kpc). Default that of params.
+    vars            Names of the variables to sweep, from AREA_VARS.
+
+    Returns an OrderedDict of 'area' and the variables in code units, each
+    of shape model.shape + np.shape(rufo).
+    """
+    for k in vars:
+        if k not in AREA_VARS:
+            raise ValueError('Error, ' + k + ' does not scale with the outflow area.')
+
+    xunit = pc.kpc / params.norm.x
+    r = params.rufo if rufo is None else np.asarray(rufo, dtype=float) * xunit
+    area = model.area_grid(r, xunit)
+
+    out = OrderedDict([('area', area)])
+    for k in vars:
+        out[k] = getattr(params, k) * params.area / area
+    return out
@@ -0,0 +1,84 @@
+# Import-time budget check.
+#
+# Imports modules in a fresh interpreter with -X importtime and checks
+# that the time spent in this repository's own modules stays within a
+# budget, and that heavy optional dependencies are not pulled in. Byte
+# code is compiled in a warm-up run first, so that compilation doesn't
+# count against the budget.
+#
+#   python importtime.py [--budget-ms 5] [module ...]
+#
+# Exits with status 1 if any budget is exceeded.
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+# Modules whose import must not pull in these (slow to import) packages
+FORBIDDEN = {
+    'ufo_parameters': ('scipy', 'sympy'),
+    'ufo_parameters_sym': ('scipy', 'sympy'),
+    'norm': ('scipy', 'sympy'),
+    'eos': ('scipy', 'sympy'),
+}
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+
+def importtime(module, cache_dir):
+    """
+    Dictionary of module name to (self, cumulative) import time in
+    microseconds for importing module in a fresh interpreter.
+    """
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env['PYTHONPYCACHEPREFIX'] = cache_dir
+    cmd = [sys.executable, '-X', 'importtime', '-c', 'import ' + module]
+
+    # Warm-up run to compile byte code
+    subprocess.run(cmd, cwd=REPO, env=env, check=True, capture_output=True)
+    out = subprocess.run(cmd, cwd=REPO, env=env, check=True, capture_output=True, text=True).stderr
+
+    times = {}
+    for line in out.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        t_self, t_cum, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(t_self), int(t_cum))
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check import time of repository modules.')
+    parser.add_argument('modules', nargs='*', default=['ufo_parameters', 'ufo_parameters_sym'])
+    parser.add_argument('--budget-ms', type=float, default=5.,
+                        help='Budget for the time spent in repository modules themselves (ms).')
+    args = parser.parse_args(argv)
+
+    own = set(f[:-3] for f in os.listdir(REPO) if f.endswith('.py'))
+
+    ok = True
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for module in args.modules:
+            times = importtime(module, cache_dir)
+            t_own = sum(t[0] for k, t in times.items() if k in own) / 1.e3
+            t_total = times[module][1] / 1.e3
+            status = 'ok'
+            if t_own > args.budget_ms:
+                status = 'over budget'
+                ok = False
+            print(format(module, '24s') + format(t_own, '>10.2f') + ' ms own' +
+                  format(t_total, '>10.2f') + ' ms total   ' + status)
+
+            for heavy in FORBIDDEN.get(module, ()):
+                if heavy in times:
+                    print(format('', '24s') + 'imports ' + heavy)
+                    ok = False
+
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
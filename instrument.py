@@ -0,0 +1,209 @@
+# Opt-in instrumentation of the equation layer.
+#
+# Records call counts, cumulative, self and per-call time, and array sizes
+# for the eqn_*, upd_*, dictionary and print methods of UfoParams and
+# UfoParamsRel, the EOSIdeal conversions, the EOSTaubMatthews primitive
+# solver and PhysNorm. Methods are only wrapped while instrumentation is
+# enabled; when disabled the original functions are restored and there is
+# no overhead at all.
+#
+# Enable it either with the context manager
+#
+#   with instrument.profile() as prof:
+#       p = ufo_parameters.UfoParams(...)
+#   prof.print_table()
+#
+# or for a whole run by setting the environment variable UFO_PROFILE
+# before ufo_parameters is imported. UFO_PROFILE=1 prints a table to
+# stderr at exit, UFO_PROFILE=<file>.json writes JSON to that file.
+
+import contextlib
+import functools
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import norm
+import eos
+import ufo_parameters as up
+
+ENV_VAR = 'UFO_PROFILE'
+
+
+class Profile():
+    """
+    Statistics of instrumented calls.
+    """
+
+    def __init__(self):
+        self.stats = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+
+    def record(self, name, t_cum, t_self, size):
+        with self.lock:
+            s = self.stats.get(name)
+            if s is None:
+                s = self.stats[name] = OrderedDict([('calls', 0), ('cumtime', 0.), ('selftime', 0.),
+                                                    ('elements', 0), ('max_size', 0)])
+            s['calls'] += 1
+            s['cumtime'] += t_cum
+            s['selftime'] += t_self
+            s['elements'] += size
+            if size > s['max_size']: s['max_size'] = size
+
+    def results(self):
+        """
+        OrderedDict of statistics per method, sorted by cumulative time.
+        """
+        with self.lock:
+            items = sorted(self.stats.items(), key=lambda kv: -kv[1]['cumtime'])
+        out = OrderedDict()
+        for name, s in items:
+            s = OrderedDict(s)
+            s['percall'] = s['cumtime'] / s['calls']
+            out[name] = s
+        return out
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.results(), **kwargs)
+
+    def print_table(self, file=None):
+        if file is None: file = sys.stdout
+        print(format('method', '40s') + format('calls', '>10s') + format('cumtime', '>14s') +
+              format('selftime', '>14s') + format('percall', '>14s') + format('max_size', '>12s'), file=file)
+        for name, s in self.results().items():
+            print(format(name, '40s') + format(s['calls'], '>10d') + format(s['cumtime'], '>14.6e') +
+                  format(s['selftime'], '>14.6e') + format(s['percall'], '>14.6e') +
+                  format(s['max_size'], '>12d'), file=file)
+
+    def wrap(self, name, fn):
+        """
+        Return a version of fn that records its calls under name.
+        Time spent in nested instrumented calls is subtracted from the
+        self time of the caller.
+        """
+        local = self.local
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            stack = getattr(local, 'stack', None)
+            if stack is None:
+                stack = local.stack = []
+            stack.append(0.)
+            t0 = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                dt = time.perf_counter() - t0
+                t_nested = stack.pop()
+                if stack: stack[-1] += dt
+            self.record(name, dt, dt - t_nested, int(np.size(result)) if result is not None else 0)
+            return result
+
+        wrapper.__wrapped__ = fn
+        return wrapper
+
+
+# Methods to instrument, per class
+def _targets():
+    targets = [(up.UfoParams, [k for k in vars(up.UfoParams)
+                               if k.startswith('eqn_') or k.startswith('update_') or k.startswith('print_')]),
+               (up.UfoParamsRel, [k for k in vars(up.UfoParamsRel) if k.startswith('eqn_')]),
+               (eos.EOSIdeal, ['eos', 'auto_eos', 'pres_from_dens_temp', 'dens_from_pres_temp',
+                               'temp_from_dens_pres']),
+               (eos.EOSTaubMatthews, ['prim_from_cons', 'cons_from_prim']),
+               (norm.PhysNorm, ['__init__', 'derive_powers', 'derive_scaling', 'to_cgs', 'from_cgs',
+                                'print_scalings'])]
+    return targets
+
+
+# The active profile and the original functions it replaced
+_active = None
+_originals = []
+
+
+def enable(prof=None):
+    """
+    Start instrumenting into prof (a new Profile by default) and return it.
+    """
+    global _active
+    if _active is not None:
+        raise RuntimeError('Instrumentation is already enabled.')
+    if prof is None: prof = Profile()
+
+    for cls, names in _targets():
+        for k in names:
+            fn = vars(cls)[k]
+            _originals.append((cls, k, fn))
+            setattr(cls, k, prof.wrap(cls.__name__ + '.' + k, fn))
+
+    # upd_ functions are created per instance, wrap them as they are made
+    create_upd_fn = vars(up.UfoParams)['create_upd_fn']
+    _originals.append((up.UfoParams, 'create_upd_fn', create_upd_fn))
+
+    def create_upd_fn_instrumented(self, var):
+        return prof.wrap(type(self).__name__ + '.upd_' + var, create_upd_fn(self, var))
+
+    up.UfoParams.create_upd_fn = create_upd_fn_instrumented
+
+    _active = prof
+    return prof
+
+
+def disable():
+    """
+    Stop instrumenting and restore the original methods. Returns the
+    profile that was active. upd_ functions of UfoParams objects created
+    while instrumentation was enabled keep recording into it.
+    """
+    global _active
+    while _originals:
+        cls, k, fn = _originals.pop()
+        setattr(cls, k, fn)
+    prof, _active = _active, None
+    return prof
+
+
+def active():
+    return _active
+
+
+@contextlib.contextmanager
+def profile(prof=None):
+    """
+    Context manager instrumenting the enclosed block.
+    """
+    prof = enable(prof)
+    try:
+        yield prof
+    finally:
+        disable()
+
+
+def enable_from_env(value):
+    """
+    Enable instrumentation for the rest of the run and report at exit,
+    configured by the value of the UFO_PROFILE environment variable.
+    """
+    import atexit
+
+    prof = enable()
+
+    def report():
+        if value.endswith('.json'):
+            with open(value, 'w') as f:
+                f.write(prof.to_json(indent=2))
+        else:
+            prof.print_table(sys.stderr)
+
+    atexit.register(report)
+    return prof
@@ -6,11 +6,43 @@
 # Requires python >= 2.7 because of OrderedDict
 
 from collections import OrderedDict
+from collections.abc import Mapping
 
 import numpy as np
 import numpy.linalg as la
 
 
+class _Derived(Mapping):
+    """
+    Mapping over all keys of a registry whose values are derived on
+    first access and then cached. Iteration, len() and in cover every
+    key of the registry, including keys registered later.
+    """
+
+    def __init__(self, registry, derive):
+        self.registry = registry
+        self.derive = derive
+        self.cache = {}
+
+    def __getitem__(self, key):
+        try:
+            return self.cache[key]
+        except KeyError:
+            if key not in self.registry:
+                raise
+        value = self.cache[key] = self.derive(key)
+        return value
+
+    def __iter__(self):
+        return iter(self.registry)
+
+    def __len__(self):
+        return len(self.registry)
+
+    def __contains__(self, key):
+        return key in self.registry
+
+
 class PhysNorm():
     """
     Class that stores units (dimensions) and scaling factors for a selection of physical
@@ -21,52 +53,91 @@ class PhysNorm():
     which one could obtain the scaling factor of one unknown (e.g. temperature). 
     The class also doesn't assume between which two systems the scaling obtains.
 
+    The quantities are kept in the registry PhysNorm.defs, shared by all
+    objects, and more can be added at any time with PhysNorm.register().
+    Objects only factor their five base scalings when created. The scaling
+    of a quantity is derived from them when it is first needed and then
+    cached. The mappings powers and scalings still cover all registered
+    quantities in order, they are read-only.
     """
 
+    # Independent SI base dimensions
+    dimdefs = ['length', 'mass', 'time', 'current', 'temperature']
+    ndims = len(dimdefs)
+
+    # The tuple of dimensions (fundamental, or base quantities) is
+    # length, mass, time, current, and temperature
+    # (L, M, T, A, K)
+    # The number in the tuple determines the power of the dimension.
+    #
+    #           Dimensions [0]        Description [2]
+    defs = OrderedDict([
+        ('x', ((1, 0, 0, 0, 0), 'position or displacement')),
+        ('m', ((0, 1, 0, 0, 0), 'mass')),
+        ('t', ((0, 0, 1, 0, 0), 'time')),
+        ('curr', ((0, 0, 0, 1, 0), 'electric current')),
+        ('temp', ((0, 0, 0, 0, 1), 'temperature')),
+        ('v', ((1, 0, -1, 0, 0), 'speed')),
+        ('dens', ((-3, 1, 0, 0, 0), 'mass density')),
+        ('pres', ((-1, 1, -2, 0, 0), 'pressure, or energy density')),
+        ('pmom', ((1, 1, -1, 0, 0), 'linear momentum')),
+        ('pden', ((-2, 1, -1, 0, 0), 'linear momentum density')),
+        ('pdot', ((1, 1, -2, 0, 0), 'rate of change of linear momentum')),
+        ('pflx', ((-1, 1, -2, 0, 0), 'linear momentum flux (pressure)')),
+        ('ener', ((2, 1, -2, 0, 0), 'energy')),
+        ('epwr', ((2, 1, -3, 0, 0), 'power or luminosity (energy per unit time)')),
+        ('eflx', ((0, 1, -3, 0, 0), 'energy flux')),
+        ('eint', ((2, 0, -2, 0, 0), 'specific (internal) energy, energy per unit mass')),
+        ('edot', ((2, 0, -3, 0, 0), 'rate of change of specific internal energy density')),
+        ('cool', ((5, 1, -3, 0, 0), 'rate of change of internal energy per unit density squared')),
+        ('mdot', ((0, 1, -1, 0, 0), 'mass outflow/accretion/loading/etc rate')),
+        ('area', ((2, 0, 0, 0, 0), 'area')),
+        ('volume', ((3, 0, 0, 0, 0), 'volume')),
+        ('newton', ((3, -1, -2, 0, 0), 'Newtons gravitational constant')),
+        ('none', ((0, 0, 0, 0, 0), 'dimensionless quantity'))
+    ])
+
+    @classmethod
+    def register(cls, name, dims, desc=''):
+        """
+        Add a quantity to the registry of all PhysNorm objects.
+
+        name            Name of the quantity, which becomes a key of
+                        scalings and an attribute of PhysNorm objects.
+        dims            Tuple of the powers of the base dimensions (see
+                        dimdefs), or the name of a registered quantity of
+                        the same dimensions.
+        desc            Description.
+
+        Registering a name again with the same dimensions is allowed, with
+        other dimensions it is an error.
+        """
+        if isinstance(dims, str):
+            if dims not in cls.defs:
+                raise ValueError('Error, Unknown key ' + dims + '.')
+            dims = cls.defs[dims][0]
+        dims = tuple(dims)
+        if len(dims) != cls.ndims:
+            raise ValueError('Dimensions of ' + name + ' must have ' + str(cls.ndims) + ' powers.')
+
+        if name in cls.defs:
+            if cls.defs[name][0] != dims:
+                raise ValueError('Error, ' + name + ' is already registered with dimensions ' +
+                                 str(cls.defs[name][0]) + '.')
+            return
+        if name.startswith('_') or hasattr(cls, name) or name in ('kwargs', 'base', 'values', 'powers', 'scalings'):
+            raise ValueError('Error, ' + name + ' is not a valid name of a quantity.')
+        cls.defs[name] = (dims, desc)
+
     def __init__(self, **kwargs):
         """
         kwargs          Varname - scaling value pairs. Currently supported 
                         varnames are those in the keys of self.defs, namely:
-                        x, m, t, curr, temp, v, dens, pres, pmom, pdot, pflx, 
-                        ener, epwr, eflx, eint, edot, cool, mdot, area, volume, 
-                        newton
+                        x, m, t, curr, temp, v, dens, pres, pmom, pden, pdot,
+                        pflx, ener, epwr, eflx, eint, edot, cool, mdot, area,
+                        volume, newton, and any registered ones
         """
 
-        # Independent SI base dimensions
-        self.dimdefs = ['length', 'mass', 'time', 'current', 'temperature']
-        self.ndims = len(self.dimdefs)
-
-        # The tuple of dimensions (fundamental, or base quantities) is
-        # length, mass, time, current, and temperature
-        # (L, M, T, A, K)
-        # The number in the tuple determines the power of the dimension.
-        #
-        #           Dimensions [0]        Description [2]
-        self.defs = OrderedDict([
-            ('x', ((1, 0, 0, 0, 0), 'position or displacement')),
-            ('m', ((0, 1, 0, 0, 0), 'mass')),
-            ('t', ((0, 0, 1, 0, 0), 'time')),
-            ('curr', ((0, 0, 0, 1, 0), 'electric current')),
-            ('temp', ((0, 0, 0, 0, 1), 'temperature')),
-            ('v', ((1, 0, -1, 0, 0), 'speed')),
-            ('dens', ((-3, 1, 0, 0, 0), 'mass density')),
-            ('pres', ((-1, 1, -2, 0, 0), 'pressure, or energy density')),
-            ('pmom', ((1, 1, -1, 0, 0), 'linear momentum')),
-            ('pdot', ((1, 1, -2, 0, 0), 'rate of change of linear momentum')),
-            ('pflx', ((-1, 1, -2, 0, 0), 'linear momentum flux (pressure)')),
-            ('ener', ((2, 1, -2, 0, 0), 'energy')),
-            ('epwr', ((2, 1, -3, 0, 0), 'power or luminosity (energy per unit time)')),
-            ('eflx', ((0, 1, -3, 0, 0), 'energy flux')),
-            ('eint', ((2, 0, -2, 0, 0), 'specific (internal) energy, energy per unit mass')),
-            ('edot', ((2, 0, -3, 0, 0), 'rate of change of specific internal energy density')),
-            ('cool', ((5, 1, -3, 0, 0), 'rate of change of internal energy per unit density squared')),
-            ('mdot', ((0, 1, -1, 0, 0), 'mass outflow/accretion/loading/etc rate')),
-            ('area', ((2, 0, 0, 0, 0), 'area')),
-            ('volume', ((3, 0, 0, 0, 0), 'volume')),
-            ('newton', ((3, -1, -2, 0, 0), 'Newtons gravitational constant')),
-            ('none', ((0, 0, 0, 0, 0), 'dimensionless quantity'))
-        ])
-
         # Test if all keys are known.
         for k in kwargs:
             if k not in self.defs:
@@ -74,7 +145,7 @@ class PhysNorm():
 
         # Create ordered dictionary of kwargs
         kwargs_od = OrderedDict.fromkeys(self.defs)
-        for k, v in kwargs_od.items():
+        for k, v in list(kwargs_od.items()):
             if k in kwargs:
                 kwargs_od[k] = kwargs[k]
             else:
@@ -84,7 +155,7 @@ class PhysNorm():
 
         # Test if one of the dimension powers is zero.
         # If so, issue error message and exit
-        cs = map(lambda l: np.sum(map(abs, l)), zip(*dims))
+        cs = [np.sum(np.abs(l)) for l in zip(*dims)]
         for i, s in enumerate(cs):
             if s == 0:
                 raise ValueError('This set of scalings is incomplete. No finite dimension for ' + self.dimdefs[i] + '.')
@@ -92,21 +163,58 @@ class PhysNorm():
         # Coefficient matrix
         cm = np.array(dims)
 
-        # Calculate powers to construct all scalings
-        scalings = OrderedDict()
-        powers = OrderedDict.fromkeys(self.defs)
-        for ip in powers:
-            powers[ip] = la.solve(cm.T, np.array(self.defs[ip][0]))
-            scalings[ip] = np.prod(np.array(kwargs_od.values()) ** powers[ip])
-        self.powers = powers
-        self.scalings = scalings
+        # Factor once: the powers of the given scalings that make up each
+        # base dimension. The powers of any quantity follow from these.
+        self.base = la.inv(cm.T)
+        self.values = np.array(list(kwargs_od.values()))
 
-        # Create attribute for this class of each variable
-        #self.__dict__.update(scalings)
-        for k, v in scalings.items(): setattr(self, k, v)
+        # Powers and scalings of quantities, derived when first needed
+        self.powers = _Derived(self.defs, self.derive_powers)
+        self.scalings = _Derived(self.defs, self.derive_scaling)
 
         return
 
+    def derive_powers(self, var):
+        """
+        Powers of the given scalings that make up the scaling of var.
+        """
+        return self.base.dot(self.defs[var][0])
+
+    def derive_scaling(self, var):
+        """
+        Scaling of var. Also sets the attribute var, so later lookups
+        are plain attribute access.
+        """
+        scaling = np.prod(self.values ** self.powers[var])
+        setattr(self, var, scaling)
+        return scaling
+
+    def __getattr__(self, name):
+        # Scalings of quantities are attributes, derived on first access
+        if name in PhysNorm.defs and 'scalings' in self.__dict__:
+            return self.scalings[name]
+        raise AttributeError(name)
+
+    def to_cgs(self, val, var, dtype=None):
+        """
+        Convert val of quantity var (a key of self.defs) from these units to cgs.
+
+        dtype           Type of the result, e.g. np.float32. The conversion
+                        itself is done in float64, only the result is rounded.
+        """
+        val = np.multiply(val, self.scalings[var], dtype=np.float64)
+        return val if dtype is None else val.astype(dtype)
+
+    def from_cgs(self, val, var, dtype=None):
+        """
+        Convert val of quantity var (a key of self.defs) from cgs to these units.
+
+        dtype           Type of the result, e.g. np.float32. The conversion
+                        itself is done in float64, only the result is rounded.
+        """
+        val = np.divide(val, self.scalings[var], dtype=np.float64)
+        return val if dtype is None else val.astype(dtype)
+
     def print_scalings(self):
         """
         Output a two column table of var name and scaling factor for all
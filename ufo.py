@@ -1,5 +1,12 @@
+import sys
+
 import ufo_parameters as up
 
+if len(sys.argv) > 1:
+    # Batch mode, see python ufo.py --help
+    import ufo_stream
+    sys.exit(ufo_stream.main())
+
 p = up.UfoParams(power=1.e44, angle=30, speed=0.01, mdot=0.1, rufo=0.1, dens_ambient=1.0, temp_ambient=1.e7,
                  gamma=1.6666666666)
 
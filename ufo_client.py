@@ -0,0 +1,149 @@
+# Thin client for the UfoParams calculation server (ufo_server.py).
+# Importing this module is cheap: it does not import numpy, norm or eos
+# unless binary (array) requests are made.
+
+import json
+import os
+import socket
+from collections import OrderedDict
+
+# Default location of the server's Unix domain socket
+DEFAULT_SOCKET = os.environ.get('UFO_SOCKET', '/tmp/ufo_parameters.sock')
+
+
+class UfoClient():
+    """
+    Connection to a running ufo_server. Requests on one connection are
+    answered in order; use one client per thread.
+    """
+
+    def __init__(self, path=None):
+        """
+        path            Path of the server's Unix domain socket.
+                        Defaults to $UFO_SOCKET or /tmp/ufo_parameters.sock.
+        """
+        self.path = DEFAULT_SOCKET if path is None else path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+        self.rfile = self.sock.makefile('rb')
+        self.nreq = 0
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _send(self, header, payload=b''):
+        self.nreq += 1
+        header['id'] = self.nreq
+        self.sock.sendall(json.dumps(header).encode() + b'\n' + payload)
+        reply = json.loads(self.rfile.readline())
+        if 'error' in reply:
+            raise ValueError('Server error: ' + reply['error'])
+        return reply
+
+    def evaluate(self, vars=None, units=('code', 'cgs'), norm=None, **params):
+        """
+        Evaluate UfoParams on the server via a JSON request.
+
+        vars            Names of the output variables. Default all.
+        units           Any of 'code' and 'cgs'.
+        norm            Dictionary of PhysNorm keyword arguments of the
+                        normalization. Default UfoParams' default.
+        params          UfoParams input parameters as scalars or lists.
+
+        Returns a dictionary with one OrderedDict of variables per unit system.
+        """
+        header = {'params': params, 'units': list(units)}
+        if vars is not None: header['vars'] = list(vars)
+        if norm is not None: header['norm'] = norm
+        reply = self._send(header)
+        return dict((u, OrderedDict(reply[u])) for u in units)
+
+    def evaluate_arrays(self, vars=None, units=('code', 'cgs'), norm=None, **params):
+        """
+        Evaluate UfoParams on the server via a binary request. Parameters
+        are sent as raw float64 columns and the results are returned as
+        numpy arrays, at most the batch size of the server (--max-batch)
+        rows per request. Arguments as for evaluate().
+        """
+        import numpy as np
+
+        cols = np.broadcast_arrays(*[np.atleast_1d(np.asarray(v, dtype='<f8')) for v in params.values()])
+        rows = cols[0].size
+        header = {'params': list(params.keys()), 'rows': rows, 'units': list(units)}
+        if vars is not None: header['vars'] = list(vars)
+        if norm is not None: header['norm'] = norm
+        reply = self._send(header, b''.join(np.ascontiguousarray(c.ravel()).tobytes() for c in cols))
+
+        data = np.frombuffer(self._read(8 * rows * len(reply['columns'])), dtype='<f8')
+        data = data.reshape(len(reply['columns']), rows)
+        result = dict((u, OrderedDict()) for u in units)
+        for col, d in zip(reply['columns'], data):
+            u, var = col.split(':', 1)
+            result[u][var] = d
+        return result
+
+    def stats(self):
+        """
+        Server latency, throughput and cache counters.
+        """
+        return self._send({'op': 'stats'})['stats']
+
+    def _read(self, n):
+        buf = self.rfile.read(n)
+        if len(buf) != n:
+            raise IOError('Connection closed by server.')
+        return buf
+
+
+class UfoParams():
+    """
+    Drop-in replacement for ufo_parameters.UfoParams in scripts, which
+    delegates the calculation to a running ufo_server. Only the variable
+    dictionaries, attributes (in code units) and print functions are
+    available.
+    """
+
+    def __init__(self, power=1.e44, angle=30, speed=0.03, mdot=0.1, rufo=0.1, dens_ambient=1.0, temp_ambient=1.e7,
+                 gamma=1.6666666666, norm=None, socket=None, client=None):
+        """
+        Parameters as for ufo_parameters.UfoParams, except
+
+          norm                 Dictionary of PhysNorm keyword arguments,
+                               or None for the server's default.
+          socket               Path of the server socket.
+          client               An open UfoClient to reuse.
+        """
+
+        params = dict(power=power, angle=angle, speed=speed, mdot=mdot, rufo=rufo,
+                      dens_ambient=dens_ambient, temp_ambient=temp_ambient, gamma=gamma)
+
+        if client is None:
+            with UfoClient(socket) as c:
+                result = c.evaluate(norm=norm, **params)
+        else:
+            result = client.evaluate(norm=norm, **params)
+
+        self.vars_code = result['code']
+        self.vars_cgs = result['cgs']
+        self.__dict__.update(self.vars_code)
+
+    def print_all_code(self):
+        for var, val in self.vars_code.items():
+            print(format(var, '16s') + format(val, '>16.8e'))
+
+    def print_all_cgs(self):
+        for var, val in self.vars_cgs.items():
+            print(format(var, '16s') + format(val, '>16.8e'))
+
+    def print_all(self):
+        for var, val_code, val_cgs in zip(self.vars_code.keys(),
+                                          self.vars_code.values(),
+                                          self.vars_cgs.values()):
+            print(format(var, '16s') + format(val_code, '>16.8e') + 3 * ' ' + format(val_cgs, '>16.8e'))
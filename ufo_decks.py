@@ -0,0 +1,216 @@
+# Batch generation of simulation input decks.
+#
+# A batch of parameter sets is evaluated at once with the fused kernel,
+# and one input deck per run (a runtime .ini parameter file and a header
+# of defines by default, or any set of user templates) is rendered into
+# its own directory, together with a manifest of all runs.
+#
+# Templates use string.Template syntax. Every variable of UfoParams is
+# available in code units as $var (e.g. $pres) and in cgs as $var_cgs
+# (e.g. $pres_cgs). Further placeholders are $run (the run name), $index
+# and $dir.
+#
+#   python ufo_decks.py campaign.csv -o runs/ [--template pluto.ini ...]
+
+import json
+import os
+import string
+import sys
+from collections import OrderedDict
+
+import ufo_parameters as up
+import ufo_kernels as uk
+
+
+def default_templates():
+    """
+    OrderedDict of file name to template text of the default deck: a
+    runtime parameter file params.ini and a header ufo_params.h.
+    """
+    width = max(len(k) for k in uk.OUTPUTS) + 4
+
+    ini = ['# UFO parameters of run $run, in code units', '', '[Parameters]', '']
+    for k, (unit, desc) in up.DEFS.items():
+        ini.append(format(k.upper(), str(width) + 's') + '$' + k)
+
+    hdr = ['/* UFO parameters of run $run, in code units */', '']
+    for k, (unit, desc) in up.DEFS.items():
+        hdr.append('#define ' + format('UFO_' + k.upper(), str(width + 4) + 's') + '($' + k + ')  /* ' + desc + ' */')
+
+    return OrderedDict([('params.ini', '\n'.join(ini) + '\n'), ('ufo_params.h', '\n'.join(hdr) + '\n')])
+
+
+def load_templates(paths):
+    """
+    OrderedDict of file name to template text, read from template files.
+    Rendered files keep the base name of their template.
+    """
+    templates = OrderedDict()
+    for path in paths:
+        with open(path) as f:
+            templates[os.path.basename(path)] = f.read()
+    return templates
+
+
+class DeckGenerator():
+    """
+    Renders input decks for batches of parameter sets. Templates are
+    compiled once, when the generator is created.
+    """
+
+    def __init__(self, templates=None, name='run_{index:04d}', norm=None, fmt='%.8e'):
+        """
+        templates       Mapping of output file name to template text.
+                        Default default_templates().
+        name            Format string of the run (directory) name, given
+                        the run index and the input parameters.
+                        Invalid formats, and templates with invalid or
+                        unknown placeholders, raise ValueError.
+        norm            Normalization of code units. Default UfoParams'.
+        fmt             Format of the values.
+        """
+        if templates is None: templates = default_templates()
+        self.templates = OrderedDict((k, string.Template(v)) for k, v in templates.items())
+        self.name = name
+        self.fmt = fmt
+        self.kernel = uk.Kernel(norm)
+
+        # Check the name format and the placeholders of all templates up front
+        try:
+            name.format(index=0, **dict((k, float(v)) for k, v in uk.DEFAULTS.items()))
+        except KeyError as e:
+            raise ValueError('Error, unknown field ' + str(e.args[0]) + ' in run name format ' + name + '.')
+        except (IndexError, AttributeError, ValueError) as e:
+            raise ValueError('Error, invalid run name format ' + name + ': ' + str(e) + '.')
+        known = set(uk.OUTPUTS) | set(k + '_cgs' for k in uk.OUTPUTS) | {'run', 'index', 'dir'}
+        for fname, t in self.templates.items():
+            for m in t.pattern.finditer(t.template):
+                if m.group('invalid') is not None:
+                    line = t.template.count('\n', 0, m.start('invalid')) + 1
+                    raise ValueError('Invalid placeholder in line ' + str(line) + ' of template ' + fname + '.')
+                key = m.group('named') or m.group('braced')
+                if key is not None and key not in known:
+                    raise ValueError('Unknown placeholder $' + key + ' in template ' + fname + '.')
+
+    def evaluate(self, **inputs):
+        """
+        All variables for the batch of inputs, in code units and cgs.
+        """
+        code = self.kernel.evaluate(units='code', **inputs)
+        cgs = OrderedDict((k, v * self.kernel.scalings[k]) for k, v in code.items())
+        return code, cgs
+
+    def run_names(self, params, n):
+        """
+        Run names of the n parameter sets of broadcast params. Raises
+        ValueError if names are not unique, as their decks would
+        overwrite each other.
+        """
+        names = []
+        seen = {}
+        for i in range(n):
+            given = dict((k, float(v[i]) if v.ndim else float(v)) for k, v in params.items())
+            run = self.name.format(index=i, **given)
+            if run in seen:
+                raise ValueError('Error, run ' + str(i) + ' and run ' + str(seen[run]) + ' have the same name ' +
+                                 run + ', make the name format unique, e.g. with {index}.')
+            seen[run] = i
+            names.append(run)
+        return names
+
+    def render(self, **inputs):
+        """
+        Generator of (run name, OrderedDict of file name to rendered text)
+        for every parameter set of the batch of inputs. Run names are
+        checked to be unique before anything is rendered.
+        """
+        params, n = self.kernel.broadcast_inputs(inputs)
+        names = self.run_names(params, n)
+        code, cgs = self.evaluate(**inputs)
+
+        # Format all values column by column
+        fmt = self.fmt
+        cols = OrderedDict()
+        for k in uk.OUTPUTS:
+            cols[k] = [fmt % v for v in code[k].tolist()]
+            cols[k + '_cgs'] = [fmt % v for v in cgs[k].tolist()]
+
+        for i, run in enumerate(names):
+            values = dict((k, c[i]) for k, c in cols.items())
+            values['run'] = run
+            values['index'] = i
+            values['dir'] = run
+            yield run, OrderedDict((f, t.substitute(values)) for f, t in self.templates.items())
+
+    def write(self, outdir, **inputs):
+        """
+        Render the decks for the batch of inputs into outdir/<run>/ and
+        write outdir/manifest.json. Returns the manifest.
+        """
+        params, n = self.kernel.broadcast_inputs(inputs)
+        self.run_names(params, n)
+        os.makedirs(outdir, exist_ok=True)
+
+        runs = []
+        for i, (run, files) in enumerate(self.render(**inputs)):
+            rundir = os.path.join(outdir, run)
+            os.makedirs(rundir, exist_ok=True)
+            for fname, text in files.items():
+                with open(os.path.join(rundir, fname), 'w') as f:
+                    f.write(text)
+            runs.append(OrderedDict([('index', i), ('run', run), ('dir', run),
+                                     ('files', list(files)),
+                                     ('params', OrderedDict((k, float(v[i]) if v.ndim else float(v))
+                                                            for k, v in params.items()))]))
+
+        manifest = OrderedDict([('nruns', n), ('templates', list(self.templates)), ('runs', runs)])
+        with open(os.path.join(outdir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=1)
+        return manifest
+
+
+def main(argv=None):
+    import argparse
+    import ufo_stream
+
+    parser = argparse.ArgumentParser(description='Generate simulation input decks for a batch of UFO parameter sets.')
+    parser.add_argument('input', help="Parameter sets (.csv, .jsonl, .npy), or '-' for stdin.")
+    parser.add_argument('-o', '--outdir', required=True, help='Directory to create the run directories in.')
+    parser.add_argument('--input-format', choices=ufo_stream.FORMATS, help='Input format. Default from file name.')
+    parser.add_argument('--map', nargs='*', default=[], metavar='PARAM=COLUMN',
+                        help='Read UfoParams parameter PARAM from input column COLUMN.')
+    parser.add_argument('--template', nargs='*', help='Template files. Default params.ini and ufo_params.h.')
+    parser.add_argument('--name', default='run_{index:04d}',
+                        help='Format of run names, e.g. run_{index:04d} or p{power:.0e}_v{speed:.2f}.')
+    parser.add_argument('--norm', nargs='*', metavar='KEY=VALUE', help='PhysNorm scalings of code units.')
+    args = parser.parse_args(argv)
+
+    columns = dict(item.split('=', 1) for item in args.map)
+    for k in columns:
+        if k not in uk.INPUTS:
+            parser.error('Unknown parameter ' + k + '.')
+    reader = ufo_stream.open_reader(args.input, args.input_format or ufo_stream.guess_format(args.input), 1 << 62)
+    chunk = next(iter(reader), None)
+    if chunk is None:
+        parser.error('No parameter sets in ' + args.input + '.')
+    missing = [c for c in columns.values() if c not in chunk]
+    if missing:
+        parser.error('Column(s) ' + ', '.join(missing) + ' given in --map are not in the input.')
+    inputs = {}
+    for k in uk.INPUTS:
+        col = columns.get(k, k)
+        if col in chunk:
+            inputs[k] = chunk[col]
+
+    templates = load_templates(args.template) if args.template else None
+    try:
+        gen = DeckGenerator(templates, args.name, ufo_stream.parse_norm(args.norm))
+        manifest = gen.write(args.outdir, **inputs)
+    except (KeyError, ValueError) as e:
+        parser.error(str(e))
+    print('Wrote ' + str(manifest['nruns']) + ' decks to ' + args.outdir + '.', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+# Nearest-neighbour index over computed UFO parameters.
+# Catalogues of previously run setups are indexed in normalized
+# log-space so that the runs closest to a new target can be found
+# without a brute-force scan.
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import ufo_parameters as up
+
+
+class ParamIndex():
+    """
+    KD-tree over a catalogue of UfoParams outputs.
+
+    Every coordinate is taken as log10 of the quantity and then shifted
+    and scaled to zero mean and unit variance over the catalogue, so that
+    quantities spanning very different ranges (eflx vs. mach) carry equal
+    weight in the distance. Catalogue entries with non-positive or
+    non-finite values in any of the indexed quantities (e.g. negative
+    pressure when kinetic power exceeds total power) cannot be placed in
+    log-space and are left out of the tree.
+    """
+
+    def __init__(self, catalogue, keys=('pratio', 'dratio', 'mach', 'eflx'), units='cgs', leafsize=32):
+        """
+        catalogue       UfoParams instance evaluated with array inputs, or
+                        a mapping of variable name to array, such as
+                        UfoParams.vars_cgs.
+        keys            Names of the variables that span the search space.
+        units           'cgs' or 'code'. Which of the UfoParams dictionaries
+                        to index if catalogue is a UfoParams instance.
+                        Targets passed to the queries must be in the same units.
+        leafsize        Leaf size of the KD-tree.
+        """
+
+        if isinstance(catalogue, up.UfoParams):
+            catalogue.update_all_dictionaries()
+            if units == 'cgs':
+                catalogue = catalogue.vars_cgs
+            elif units == 'code':
+                catalogue = catalogue.vars_code
+            else:
+                raise ValueError('Error, Unknown units ' + units + '.')
+
+        for k in keys:
+            if k not in catalogue:
+                raise ValueError('Error, Unknown key ' + k + '.')
+
+        self.keys = tuple(keys)
+        self.units = units
+
+        # Broadcast all columns against each other, scalar
+        # parameters are shared by all catalogue entries.
+        cols = np.broadcast_arrays(*[np.atleast_1d(np.asarray(catalogue[k], dtype=float)).ravel() for k in keys])
+        self.size = cols[0].size
+
+        # Catalogue entries that can be placed in log-space
+        valid = np.ones(self.size, dtype=bool)
+        for c in cols:
+            valid &= np.isfinite(c) & (c > 0.)
+        self.ids = np.flatnonzero(valid)
+
+        if self.ids.size == 0:
+            raise ValueError('No catalogue entries with finite positive values for ' + ', '.join(keys) + '.')
+
+        logc = np.empty((self.ids.size, len(keys)))
+        for i, c in enumerate(cols):
+            np.log10(c[valid], out=logc[:, i])
+
+        # Normalization of log-space coordinates
+        self.offset = logc.mean(axis=0)
+        self.scale = logc.std(axis=0)
+        self.scale[self.scale == 0.] = 1.
+        logc -= self.offset
+        logc /= self.scale
+
+        self.tree = cKDTree(logc, leafsize=leafsize, balanced_tree=False, compact_nodes=False)
+
+    def coords(self, target):
+        """
+        Normalized log-space coordinates of target.
+
+        target          Mapping of variable name to scalar or array
+                        values for all of self.keys, or an array whose
+                        last axis runs over self.keys.
+        """
+
+        if hasattr(target, 'keys'):
+            cols = np.broadcast_arrays(*[np.asarray(target[k], dtype=float) for k in self.keys])
+            target = np.stack(cols, axis=-1)
+        else:
+            target = np.asarray(target, dtype=float)
+            if target.shape[-1] != len(self.keys):
+                raise ValueError('Target must have ' + str(len(self.keys)) + ' values along its last axis.')
+
+        return (np.log10(target) - self.offset) / self.scale
+
+    def query(self, target, k=1, workers=-1):
+        """
+        Find the k catalogue entries closest to target.
+
+        Returns the distances in normalized log-space and the indices
+        of the entries in the original catalogue. If the tree holds fewer
+        than k entries, missing neighbours have infinite distance and
+        index -1.
+        """
+
+        dist, ii = self.tree.query(self.coords(target), k=k, workers=workers)
+        return dist, self._catalogue_ids(ii)
+
+    def query_radius(self, target, r, workers=-1, return_sorted=True):
+        """
+        Find all catalogue entries within normalized log-space distance r
+        of target.
+
+        Returns an array of catalogue indices for a single target, or an
+        object array of index arrays for an array of targets.
+        """
+
+        ii = self.tree.query_ball_point(self.coords(target), r, workers=workers, return_sorted=return_sorted)
+
+        if isinstance(ii, list):
+            return self.ids[np.asarray(ii, dtype=np.intp)]
+
+        out = np.empty(ii.shape, dtype=object)
+        for j, l in np.ndenumerate(ii):
+            out[j] = self.ids[np.asarray(l, dtype=np.intp)]
+        return out
+
+    def _catalogue_ids(self, ii):
+        """
+        Map tree row numbers onto catalogue indices. Missing neighbours,
+        which cKDTree flags with the tree size, are mapped to -1.
+        """
+
+        ii = np.asarray(ii)
+        return np.where(ii < self.ids.size, self.ids[np.minimum(ii, self.ids.size - 1)], -1)
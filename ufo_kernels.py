@@ -0,0 +1,417 @@
+# Fused, allocation-free evaluation of all UfoParams variables.
+#
+# The equations of UfoParams (eqn_* functions) are evaluated for a batch
+# of parameter sets block by block, with in-place (out=) ufunc operations
+# into the output arrays and a few block-sized work buffers, instead of
+# creating a fresh temporary array for every arithmetic step. Blocks are
+# small enough that the operands of a block stay in cache.
+#
+# Outputs can be stored in a lower precision, e.g. float32, to halve
+# memory and I/O. All arithmetic is still done in float64, in block-sized
+# staging buffers, and only the final values are rounded to the output
+# type. precision_report() tells which outputs lose accuracy in the process.
+# Values outside the range of the output type are never stored as inf or 0:
+# evaluation raises OverflowError instead, and storage_dtypes() picks a type
+# per variable that keeps such variables in float64.
+
+import inspect
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+import physconst as pc
+import ufo_parameters as up
+
+# Input parameters of UfoParams, in the units UfoParams takes them
+INPUTS = ('power', 'angle', 'speed', 'mdot', 'rufo', 'dens_ambient', 'temp_ambient', 'gamma')
+
+# Defaults of the input parameters
+DEFAULTS = dict((k, v.default) for k, v in inspect.signature(up.UfoParams.__init__).parameters.items() if k in INPUTS)
+
+# All variables, in the order of UfoParams.defs
+OUTPUTS = tuple(up.DEFS)
+
+# Number of work buffers a block needs
+NWORK = 2
+
+# Outputs that only depend on the ambient medium, and on the geometry
+AMBIENT = ('pres_ambient', 'eint_ambient', 'vsnd_ambient')
+GEOMETRY = ('area',)
+
+
+class Kernel():
+    """
+    Evaluates all variables of UfoParams for batches of parameter sets.
+
+    Results agree with UfoParams(**inputs).vars_code (or vars_cgs) to
+    rounding error. Work buffers are allocated once per Kernel, so one
+    Kernel must not be used by several threads at the same time, unless
+    each passes its own work buffers (see new_work()).
+    """
+
+    def __init__(self, norm=None, block=16384, muu=None, mua=None):
+        """
+        norm            Normalization of code units. Default UfoParams'.
+        block           Number of parameter sets per block.
+        muu, mua        Mean mass per particle of ufo and ambient gas.
+                        Default those of CompositionUfo and CompositionISM.
+        """
+
+        if norm is None: norm = up.default_norm()
+        if muu is None: muu = up.CompositionUfo().mu
+        if mua is None: mua = up.CompositionISM().mu
+
+        self.norm = norm
+        self.block = block
+
+        # Conversion factors of input parameters into code units
+        self.fac = {
+            'power': 1. / norm.epwr,
+            'angle': 1.,
+            'speed': pc.c / norm.v,
+            'mdot': pc.msun / pc.yr / norm.mdot,
+            'rufo': pc.kpc / norm.x,
+            'dens_ambient': mua * pc.amu / norm.dens,
+            'temp_ambient': 1. / norm.temp,
+            'gamma': 1.,
+        }
+
+        # Ideal gas EOS constants in code units (see eos.EOSIdeal)
+        self.k_pres_ambient = norm.dens * norm.temp * pc.kboltz / (mua * pc.amu) / norm.pres
+        self.k_temp = muu * pc.amu * norm.pres / (norm.dens * pc.kboltz) / norm.temp
+
+        # Scalings to cgs
+        self.scalings = dict((k, norm.scalings[up.DEFS[k][0]]) for k in OUTPUTS)
+
+        self.work = self.new_work()
+
+    def new_work(self, staging=False):
+        """
+        A new set of work buffers for one block. Outputs that are not
+        float64 need the additional float64 staging buffers.
+        """
+        return np.empty((NWORK + len(OUTPUTS) if staging else NWORK, self.block))
+
+    def new_output(self, n, dtype=float):
+        """
+        A new OrderedDict of output arrays of length n. dtype is a type,
+        or a mapping of variable name to type, e.g. from storage_dtypes().
+        """
+        dtypes = output_dtypes(dtype)
+        return OrderedDict((k, np.empty(n, dtype=dtypes[k])) for k in OUTPUTS)
+
+    @staticmethod
+    def broadcast_inputs(inputs):
+        """
+        Check input names and return them as 1d arrays (or scalars)
+        and their common length.
+        """
+        for k in inputs:
+            if k not in INPUTS:
+                raise ValueError('Error, Unknown parameter ' + k + '.')
+
+        params = {}
+        n = 1
+        for k in INPUTS:
+            v = inputs.get(k, DEFAULTS[k])
+            v = np.asarray(v, dtype=float)
+            if v.ndim > 1:
+                raise ValueError('Input parameter ' + k + ' must be scalar or one dimensional.')
+            if v.ndim == 1:
+                if n > 1 and v.size != n:
+                    raise ValueError('Input parameters must have the same length.')
+                n = v.size
+            params[k] = v
+        return params, n
+
+    def evaluate(self, out=None, units='code', work=None, dtype=float, **inputs):
+        """
+        Evaluate all variables for the batch of inputs.
+
+        out             Mapping of variable name to output array of the
+                        batch length, e.g. from new_output(). Default new arrays.
+        units           'code' or 'cgs'.
+        work            Work buffers from new_work(). Default self.work.
+        dtype           Type of new output arrays, e.g. np.float32.
+                        Calculations are done in float64 regardless.
+        inputs          UfoParams input parameters, scalars or 1d arrays
+                        of a common length. Missing parameters take the
+                        UfoParams defaults.
+
+        Returns out.
+        """
+        params, n = self.broadcast_inputs(inputs)
+        if out is None: out = self.new_output(n, dtype)
+        self.evaluate_blocks(params, out, 0, n, units, work)
+        return out
+
+    def evaluate_blocks(self, params, out, start, stop, units='code', work=None):
+        """
+        Evaluate rows start to stop of the batch of broadcast params (see
+        broadcast_inputs()) block by block into the same rows of out.
+        """
+        if work is None: work = self._default_work(out)
+        for i0 in range(start, stop, self.block):
+            self.evaluate_block(params, out, slice(i0, min(i0 + self.block, stop)), units, work)
+
+    def iter_blocks(self, units='code', dtype=float, **inputs):
+        """
+        Generator evaluating the batch of inputs block by block into one
+        set of block-sized output buffers of type dtype. Yields the slice
+        of the batch and the OrderedDict of output views, which are
+        overwritten by the next block, so memory use is independent of
+        the batch length.
+        """
+        params, n = self.broadcast_inputs(inputs)
+        buf = self.new_output(min(self.block, n), dtype)
+        work = self._default_work(buf)
+        for i0 in range(0, n, self.block):
+            sl = slice(i0, min(i0 + self.block, n))
+            o = OrderedDict((k, v[:sl.stop - sl.start]) for k, v in buf.items())
+            self.evaluate_block(params, o, sl, units, work, out_offset=i0)
+            yield sl, o
+
+    @staticmethod
+    def needs_staging(out):
+        return any(out[k].dtype != np.float64 for k in OUTPUTS)
+
+    def _default_work(self, out):
+        """
+        self.work, with staging buffers added if out needs them.
+        """
+        if self.needs_staging(out) and self.work.shape[0] == NWORK:
+            self.work = self.new_work(staging=True)
+        return self.work
+
+    def evaluate_block(self, params, out, sl, units='code', work=None, out_offset=0, const=None):
+        """
+        Evaluate one block sl of the batch of broadcast params (see
+        broadcast_inputs()) into out[k][sl.start - out_offset:sl.stop - out_offset].
+
+        const           Precomputed values in code units of all outputs of
+                        AMBIENT or GEOMETRY (or both), when these do not vary
+                        within the batch. They are filled in rather than
+                        calculated.
+        """
+        m = sl.stop - sl.start
+        osl = slice(sl.start - out_offset, sl.stop - out_offset)
+        o = dict((k, out[k][osl]) for k in OUTPUTS)
+        if work is None: work = self._default_work(out)
+        w0, w1 = work[0, :m], work[1, :m]
+
+        # Calculate in float64 staging buffers if the output is of another type
+        staged = self.needs_staging(o)
+        if staged:
+            if work.shape[0] < NWORK + len(OUTPUTS):
+                raise ValueError('Work buffers have no staging buffers, see new_work().')
+            final = o
+            o = dict((k, work[NWORK + i, :m]) for i, k in enumerate(OUTPUTS))
+
+        # Input parameters in code units
+        for k in INPUTS:
+            v = params[k]
+            np.multiply(v[sl] if v.ndim else v, self.fac[k], out=o[k])
+
+        power, speed, mdot, rufo = o['power'], o['speed'], o['mdot'], o['rufo']
+        dens_a, temp_a, gamma = o['dens_ambient'], o['temp_ambient'], o['gamma']
+
+        # Ambient medium
+        if const is None: const = {}
+        pres_a = o['pres_ambient']
+        if all(k in const for k in AMBIENT):
+            for k in AMBIENT:
+                o[k].fill(const[k])
+        else:
+            np.multiply(dens_a, temp_a, out=pres_a)
+            pres_a *= self.k_pres_ambient
+
+            np.subtract(gamma, 1., out=w1)
+            np.multiply(dens_a, w1, out=w0)
+            np.divide(pres_a, w0, out=o['eint_ambient'])
+
+            np.multiply(gamma, pres_a, out=w0)
+            w0 /= dens_a
+            np.sqrt(w0, out=o['vsnd_ambient'])
+
+        # Area of the spherical cap, 2 pi r^2 / (1 + cos alpha) (see geometry.SphericalCap)
+        area = o['area']
+        if all(k in const for k in GEOMETRY):
+            area.fill(const['area'])
+        else:
+            np.radians(o['angle'], out=w0)
+            np.cos(w0, out=w1)
+            w1 += 1.
+            np.multiply(rufo, rufo, out=area)
+            area /= w1
+            area *= 2. * np.pi
+
+        # Ufo pressure
+        pres = o['pres']
+        np.multiply(speed, speed, out=w0)
+        w0 *= mdot
+        w0 *= 0.5
+        np.subtract(power, w0, out=pres)
+        np.subtract(gamma, 1., out=w1)
+        pres *= w1
+        np.multiply(gamma, area, out=w0)
+        w0 *= speed
+        pres /= w0
+
+        # Density (w0 still is gamma*area*speed)
+        dens = o['dens']
+        np.divide(w0, gamma, out=w0)
+        np.divide(mdot, w0, out=dens)
+
+        # Temperature
+        np.divide(pres, dens, out=w0)
+        np.multiply(w0, self.k_temp, out=o['temp'])
+
+        # Specific internal energy and enthalpy (w0 is pres/dens, w1 gamma - 1)
+        np.divide(w0, w1, out=o['eint'])
+        np.add(o['eint'], w0, out=o['enth'])
+
+        np.divide(speed, o['vsnd_ambient'], out=o['mach'])
+        np.divide(power, area, out=o['eflx'])
+        np.divide(pres, pres_a, out=o['pratio'])
+        np.divide(dens, dens_a, out=o['dratio'])
+        np.multiply(mdot, speed, out=o['pdot'])
+        np.divide(o['pdot'], area, out=o['pflx'])
+
+        if units == 'cgs':
+            for k in OUTPUTS:
+                s = self.scalings[k]
+                if s != 1.:
+                    o[k] *= s
+        elif units != 'code':
+            raise ValueError('Error, Unknown units ' + units + '.')
+
+        # Round to output type, refusing values out of its range
+        if staged:
+            for k in OUTPUTS:
+                if final[k].dtype != np.float64 and not in_range(o[k], final[k].dtype):
+                    raise OverflowError('Error, values of ' + k + ' are out of the range of ' +
+                                        final[k].dtype.name + ', see storage_dtypes().')
+            for k in OUTPUTS:
+                np.copyto(final[k], o[k], casting='unsafe')
+
+
+def output_dtypes(dtype):
+    """
+    Dictionary of variable name to output type, from a type or a mapping
+    of variable name to type (float64 for missing variables).
+    """
+    if hasattr(dtype, 'items'):
+        return dict((k, np.dtype(dtype.get(k, np.float64))) for k in OUTPUTS)
+    return dict.fromkeys(OUTPUTS, np.dtype(dtype))
+
+
+def in_range(values, dtype):
+    """
+    Whether all finite, nonzero values are within the range of normal
+    numbers of the floating point type dtype.
+    """
+    info = np.finfo(dtype)
+    with np.errstate(invalid='ignore'):
+        a = np.abs(values)
+        return not (np.any((a > info.max) & np.isfinite(a)) or np.any((a < info.tiny) & (a > 0.)))
+
+
+def storage_dtypes(dtype, outputs, names=OUTPUTS):
+    """
+    OrderedDict of variable name to storage type: dtype for the variables
+    whose values in outputs (float64 arrays, e.g. of a first chunk) are
+    in its range, float64 for the others.
+    """
+    return OrderedDict((k, np.dtype(dtype) if in_range(outputs[k], dtype) else np.dtype(np.float64))
+                       for k in names)
+
+
+def evaluate(units='code', norm=None, block=16384, out=None, dtype=float, **inputs):
+    """
+    Evaluate all UfoParams variables for a batch of inputs with a fused
+    Kernel. See Kernel.evaluate().
+    """
+    return Kernel(norm, block).evaluate(out, units, dtype=dtype, **inputs)
+
+
+class PrecisionReport():
+    """
+    Accumulates the accuracy lost by storing float64 values in a lower
+    precision type, per variable.
+    """
+
+    def __init__(self, dtype=np.float32, rtol=5.e-5):
+        """
+        dtype           Storage type.
+        rtol            Relative error above which a variable counts as
+                        losing accuracy. The default corresponds to about
+                        4 significant digits.
+        """
+        self.dtype = np.dtype(dtype)
+        self.rtol = rtol
+        self.stats = OrderedDict()
+
+    def update(self, name, ref, stored=None):
+        """
+        Compare float64 values ref with stored, their values in self.dtype
+        (computed from ref if not given).
+        """
+        ref = np.asarray(ref, dtype=np.float64)
+        if stored is None:
+            with np.errstate(over='ignore', under='ignore'):
+                stored = ref.astype(self.dtype)
+        stored = np.asarray(stored, dtype=np.float64)
+        finite = np.isfinite(ref)
+        nonzero = finite & (ref != 0.)
+        overflow = finite & ~np.isfinite(stored)
+        underflow = nonzero & (stored == 0.)
+        good = nonzero & ~overflow & ~underflow
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            relerr = np.abs(stored[good] / ref[good] - 1.)
+
+        s = self.stats.setdefault(name, OrderedDict([('count', 0), ('max_relerr', 0.), ('overflow', 0),
+                                                     ('underflow', 0)]))
+        s['count'] += ref.size
+        if relerr.size:
+            s['max_relerr'] = max(s['max_relerr'], float(relerr.max()))
+        s['overflow'] += int(overflow.sum())
+        s['underflow'] += int(underflow.sum())
+
+    def lossy(self):
+        """
+        Names of the variables that lose accuracy.
+        """
+        return [k for k, s in self.stats.items()
+                if s['max_relerr'] > self.rtol or s['overflow'] or s['underflow']]
+
+    def results(self):
+        out = OrderedDict()
+        for k, s in self.stats.items():
+            s = OrderedDict(s)
+            s['lossy'] = k in self.lossy()
+            out[k] = s
+        return out
+
+    def print_table(self, file=None):
+        if file is None: file = sys.stdout
+        print(format('variable', '16s') + format('max_relerr', '>14s') + format('overflow', '>10s') +
+              format('underflow', '>10s'), file=file)
+        lossy = self.lossy()
+        for k, s in self.stats.items():
+            print(format(k, '16s') + format(s['max_relerr'], '>14.4e') + format(s['overflow'], '>10d') +
+                  format(s['underflow'], '>10d') + ('   LOSSY' if k in lossy else ''), file=file)
+
+
+def precision_report(dtype=np.float32, units='code', norm=None, rtol=5.e-5, **inputs):
+    """
+    PrecisionReport of storing all UfoParams variables for a batch of
+    inputs in dtype instead of float64.
+    """
+    report = PrecisionReport(dtype, rtol)
+    k = Kernel(norm)
+    for sl, o in k.iter_blocks(units, **inputs):
+        for name in OUTPUTS:
+            report.update(name, o[name])
+    return report
@@ -0,0 +1,325 @@
+# Parallel batch evaluation of all UfoParams variables.
+#
+# Numpy ufuncs release the GIL, so the fused block kernel of ufo_kernels
+# scales across cores with plain threads: the batch is split into
+# contiguous ranges of blocks and every worker thread evaluates its range
+# into its slice of the shared output arrays, with its own work buffers.
+#
+# For process pools, the input and output columns are placed in one
+# multiprocessing.shared_memory block instead, which every worker process
+# attaches to and computes its range of rows in place. Nothing but the
+# block name and row ranges is pickled.
+
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import ufo_kernels as uk
+
+
+def default_threads():
+    """
+    Number of threads from the environment variable UFO_NUM_THREADS, or
+    the number of CPUs available to this process.
+    """
+    n = os.environ.get('UFO_NUM_THREADS')
+    if n:
+        return int(n)
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def split_blocks(n, block, parts):
+    """
+    Split range(n) into at most parts contiguous ranges aligned to block.
+    Returns a list of (start, stop) tuples.
+    """
+    nblocks = (n + block - 1) // block
+    parts = max(1, min(parts, nblocks))
+    ranges = []
+    for i in range(parts):
+        b0 = i * nblocks // parts
+        b1 = (i + 1) * nblocks // parts
+        ranges.append((b0 * block, min(b1 * block, n)))
+    return ranges
+
+
+class ThreadedKernel():
+    """
+    Evaluates all variables of UfoParams for batches of parameter sets
+    on a pool of threads. The pool is kept for the lifetime of the
+    object; call close() (or use it as a context manager) to stop it.
+    """
+
+    def __init__(self, norm=None, block=16384, nthreads=None, tasks_per_thread=4):
+        """
+        norm            Normalization of code units. Default UfoParams'.
+        block           Number of parameter sets per block.
+        nthreads        Number of threads. Default default_threads().
+        tasks_per_thread
+                        Number of block ranges per thread a batch is split
+                        into, for load balancing.
+        """
+        self.kernel = uk.Kernel(norm, block)
+        self.nthreads = default_threads() if nthreads is None else nthreads
+        self.tasks_per_thread = tasks_per_thread
+        self.executor = ThreadPoolExecutor(self.nthreads) if self.nthreads > 1 else None
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def new_output(self, n, dtype=float):
+        return self.kernel.new_output(n, dtype)
+
+    def evaluate(self, out=None, units='code', dtype=float, **inputs):
+        """
+        Evaluate all variables for the batch of inputs. Arguments as for
+        ufo_kernels.Kernel.evaluate(). Returns out.
+        """
+        k = self.kernel
+        params, n = k.broadcast_inputs(inputs)
+        if out is None: out = k.new_output(n, dtype)
+
+        if self.executor is None or n <= k.block:
+            k.evaluate_blocks(params, out, 0, n, units)
+            return out
+
+        staging = k.needs_staging(out)
+        ranges = split_blocks(n, k.block, self.nthreads * self.tasks_per_thread)
+        futures = [self.executor.submit(k.evaluate_blocks, params, out, i0, i1, units, k.new_work(staging))
+                   for i0, i1 in ranges]
+        for f in futures:
+            f.result()
+        return out
+
+
+def evaluate_threaded(units='code', norm=None, block=16384, out=None, nthreads=None, dtype=float, **inputs):
+    """
+    Evaluate all UfoParams variables for a batch of inputs with a
+    ThreadedKernel. See ufo_kernels.Kernel.evaluate().
+    """
+    with ThreadedKernel(norm, block, nthreads) as k:
+        return k.evaluate(out, units, dtype, **inputs)
+
+
+def _attach(name):
+    """
+    Attach to an existing shared memory block without registering it
+    with the resource tracker, which would otherwise unlink it when the
+    attaching process exits.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no track argument, suppress registration
+        from multiprocessing import resource_tracker
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class SharedBatch():
+    """
+    Input columns (float64) and output columns (one per variable of
+    UfoParams, of type dtype per variable) of a batch of n parameter sets in one shared
+    memory block. The columns are numpy views on the block, in the
+    OrderedDicts inputs and outputs.
+
+    The process that creates a SharedBatch owns the block and must
+    unlink() it when done (or use the SharedBatch as a context manager).
+    Views must not be used after close().
+    """
+
+    def __init__(self, n, inputs=uk.INPUTS, name=None, dtype=float):
+        """
+        n               Number of parameter sets.
+        inputs          Names of the input parameters given as columns.
+        name            Name of an existing block to attach to.
+                        Default create a new block.
+        dtype           Type of the output columns, or a mapping of
+                        variable name to type (see ufo_kernels.storage_dtypes()).
+        """
+        self.n = n
+        self.input_names = tuple(inputs)
+        self.dtypes = uk.output_dtypes(dtype)
+        nin = len(self.input_names)
+
+        # Offsets of the output columns, aligned to 8 bytes
+        offsets = []
+        size = 8 * n * nin
+        for k in uk.OUTPUTS:
+            offsets.append(size)
+            size += (self.dtypes[k].itemsize * n + 7) // 8 * 8
+
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+            self.owner = True
+        else:
+            self.shm = _attach(name)
+            self.owner = False
+        self.name = self.shm.name
+
+        din = np.ndarray((nin, n), dtype=float, buffer=self.shm.buf)
+        self.inputs = OrderedDict((k, din[i]) for i, k in enumerate(self.input_names))
+        self.outputs = OrderedDict((k, np.ndarray(n, dtype=self.dtypes[k], buffer=self.shm.buf, offset=offsets[i]))
+                                   for i, k in enumerate(uk.OUTPUTS))
+
+    def close(self):
+        """
+        Release the views and detach from the block.
+        """
+        self.inputs = None
+        self.outputs = None
+        self.shm.close()
+
+    def unlink(self):
+        """
+        Close and free the block. Only for the owner.
+        """
+        self.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.unlink()
+
+
+# Kernel of a worker process
+_kernel = None
+
+
+def _init_worker(norm, block):
+    global _kernel
+    _kernel = uk.Kernel(norm, block)
+
+
+def _evaluate_shared(name, n, inputs, dtype, scalars, start, stop, units):
+    """
+    Evaluate rows start to stop of the SharedBatch name in a worker.
+    """
+    batch = SharedBatch(n, inputs, name, dtype)
+    try:
+        params = dict(batch.inputs)
+        for k, v in scalars.items():
+            params[k] = np.asarray(v, dtype=float)
+        _kernel.evaluate_blocks(params, batch.outputs, start, stop, units)
+        del params
+    finally:
+        batch.close()
+
+
+class ProcessKernel():
+    """
+    Evaluates all variables of UfoParams for batches of parameter sets
+    on a pool of processes sharing memory with this one. The pool is
+    kept for the lifetime of the object; call close() (or use it as a
+    context manager) to stop it.
+    """
+
+    def __init__(self, norm=None, block=16384, nprocs=None, tasks_per_proc=4, mp_context=None):
+        """
+        norm            Normalization of code units. Default UfoParams'.
+        block           Number of parameter sets per block.
+        nprocs          Number of processes. Default default_threads().
+        tasks_per_proc  Number of block ranges per process a batch is split
+                        into, for load balancing.
+        mp_context      multiprocessing context. Default the platform's.
+        """
+        self.kernel = uk.Kernel(norm, block)
+        self.block = block
+        self.nprocs = default_threads() if nprocs is None else nprocs
+        self.tasks_per_proc = tasks_per_proc
+        self.executor = ProcessPoolExecutor(self.nprocs, mp_context=mp_context, initializer=_init_worker,
+                                            initargs=(self.kernel.norm, block))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def new_batch(self, n, inputs=uk.INPUTS, dtype=float):
+        """
+        A new SharedBatch of n parameter sets, whose input columns can be
+        filled in place and then passed to evaluate().
+        """
+        return SharedBatch(n, inputs, dtype=dtype)
+
+    def evaluate(self, units='code', batch=None, dtype=float, **inputs):
+        """
+        Evaluate all variables for a batch of parameter sets.
+
+        units           'code' or 'cgs'.
+        batch           SharedBatch with filled input columns. Default a
+                        new one, into which the array inputs are copied.
+        dtype           Type of the output columns of a new batch, or a
+                        mapping of variable name to type.
+        inputs          Further UfoParams input parameters, scalars or 1d
+                        arrays (copied into a new batch). Missing parameters
+                        take the UfoParams defaults.
+
+        Returns the SharedBatch, whose outputs are views on shared memory.
+        The caller owns it and must unlink() it when done.
+        """
+        if units not in ('code', 'cgs'):
+            raise ValueError('Error, Unknown units ' + units + '.')
+
+        created = batch is None
+        if created:
+            params, n = self.kernel.broadcast_inputs(inputs)
+            arrays = [k for k in uk.INPUTS if params[k].ndim]
+            batch = self.new_batch(n, arrays, dtype)
+            for k in arrays:
+                batch.inputs[k][:] = params[k]
+            scalars = dict((k, float(v)) for k, v in params.items() if not v.ndim)
+        else:
+            given = dict(batch.inputs, **inputs)
+            params, n = self.kernel.broadcast_inputs(given)
+            if n != batch.n:
+                raise ValueError('Input parameters must have the length of the batch.')
+            for k in inputs:
+                if np.ndim(inputs[k]):
+                    raise ValueError('Array input ' + k + ' must be placed in the batch.')
+            scalars = dict((k, float(v)) for k, v in params.items() if k not in batch.inputs)
+
+        ranges = split_blocks(batch.n, self.block, self.nprocs * self.tasks_per_proc)
+        dtypes = dict((k, t.str) for k, t in batch.dtypes.items())
+        futures = []
+        try:
+            for i0, i1 in ranges:
+                futures.append(self.executor.submit(_evaluate_shared, batch.name, batch.n, batch.input_names,
+                                                    dtypes, scalars, i0, i1, units))
+            for f in futures:
+                f.result()
+        except BaseException:
+            # Workers must be done with the block before it is freed
+            for f in futures:
+                f.cancel()
+            wait(futures)
+            if created:
+                batch.unlink()
+            raise
+        return batch
@@ -1,9 +1,12 @@
 # Requires python >= 2.7 because of OrderedDict
 
+import os
+
 import physconst as pc
 import numpy as np
 import norm
 import eos
+import geometry as geo
 from collections import OrderedDict
 
 
@@ -25,6 +28,49 @@ class CompositionISM(eos.CompositionBase):
         eos.CompositionBase.__init__(self, mu)
 
 
+# Variables of UfoParams: (type of units, description)
+DEFS = OrderedDict([
+    ('power', ('epwr', 'Ufo power')),
+    ('angle', ('none', 'Polar angle of UFO')),
+    ('speed', ('v', 'Ufo speed')),
+    ('mdot', ('mdot', 'Ufo mass outflow rate')),
+    ('rufo', ('x', 'Ufo radius')),
+    ('temp_ambient', ('temp', 'Reference temperature of background ISM.')),
+    ('dens_ambient', ('dens', 'Reference density of background ISM.')),
+    ('gamma', ('none', 'Adiabiatic index')),
+    ('pres_ambient', ('pres', 'Reference pressure of background ISM.')),
+    ('eint_ambient', ('eint', 'Ambient internal energy')),
+    ('vsnd_ambient', ('v', 'Ambient sound speed')),
+    ('area', ('area', 'Outflow area')),
+    ('pres', ('pres', 'Ufo pressure')),
+    ('dens', ('dens', 'Ufo density')),
+    ('temp', ('temp', 'Ufo temperature')),
+    ('mach', ('none', 'Ufo mach number')),
+    ('eflx', ('eflx', 'Ufo energy flux.')),
+    ('pratio', ('none', 'Pressure ratio (ufo/ISM).')),
+    ('dratio', ('none', 'Density ratio (ufo/ISM).')),
+    ('eint', ('eint', 'Ufo Specific internal energy')),
+    ('enth', ('eint', 'Ufo Specific enthalpy')),
+    ('pdot', ('pdot', 'Ufo Momentum injection rate.')),
+    ('pflx', ('pres', 'Ufo Momentum flux.')),
+])
+
+
+_default_norm = None
+
+
+def default_norm():
+    """
+    Default normalization of UfoParams: kpc, kyr, mean mass per particle
+    and the corresponding temperature. Constructed on first use and shared.
+    """
+    global _default_norm
+    if _default_norm is None:
+        _default_norm = norm.PhysNorm(x=pc.kpc, t=pc.kyr, dens=0.6165 * pc.amu,
+                                      temp=(pc.kpc / pc.kyr) ** 2 * pc.amu / pc.kboltz, curr=1)
+    return _default_norm
+
+
 class UfoParams():
     """ 
     This class contains functions to calculate parameters of a relativistic ufo
@@ -32,14 +78,17 @@ class UfoParams():
     are required, PhysNorm classes should be used.
     """
 
+    # Variables of this class: (type of units, description)
+    variables = DEFS
+
     def __init__(self, power=1.e44, angle=30, speed=0.03, mdot=0.1, rufo=0.1, dens_ambient=1.0, temp_ambient=1.e7,
-                 gamma=1.6666666666, norm=norm.PhysNorm(x=pc.kpc, t=pc.kyr, dens=0.6165 * pc.amu,
-                                                        temp=(pc.kpc / pc.kyr) ** 2 * pc.amu / pc.kboltz, curr=1)):
+                 gamma=1.6666666666, norm=None, geometry=None):
         """
         Parameters
 
           power                Ufo power (erg s^-1)
-          angle                Polar angle (in degrees)
+          angle                Polar angle (in degrees) of the default
+                               spherical cap geometry
           speed                Ufo speed (in c)
           mdot                 Ufo mass outflow rate (Msun/yr)
           rufo                 Ufo radius (kpc)
@@ -49,9 +98,15 @@ class UfoParams():
           gamma                Adiabiatic index non-relativistic
           norm                 Normalization object for output. 
                                Internally all units are brought to this base too.
-jj
+                               Default default_norm().
+          geometry             Launch geometry model (see geometry.py), with
+                               lengths in kpc. Default a spherical cap,
+                               geometry.SphericalCap(angle).
         """
 
+        if norm is None: norm = default_norm()
+        if geometry is None: geometry = geo.SphericalCap(angle)
+
         # All attributes in class are stored in dictionary
         # self.__dict__ whose update function can be used to 
         # append it with a list of local variables.
@@ -64,31 +119,7 @@ jj
         args = self.__dict__.copy()
 
         # Dictionary of variable names, their type of units
-        self.defs = OrderedDict([
-            ('power', ('epwr', 'Ufo power')),
-            ('angle', ('none', 'Polar angle of UFO')),
-            ('speed', ('v', 'Ufo speed')),
-            ('mdot', ('mdot', 'Ufo mass outflow rate')),
-            ('rufo', ('x', 'Ufo radius')),
-            ('temp_ambient', ('temp', 'Reference temperature of background ISM.')),
-            ('dens_ambient', ('dens', 'Reference density of background ISM.')),
-            ('gamma', ('none', 'Adiabiatic index')),
-            ('pres_ambient', ('pres', 'Reference pressure of background ISM.')),
-            ('eint_ambient', ('eint', 'Ambient internal energy')),
-            ('vsnd_ambient', ('v', 'Ambient sound speed')),
-            ('area', ('area', 'Outflow area')),
-            ('pres', ('pres', 'Ufo pressure')),
-            ('dens', ('dens', 'Ufo density')),
-            ('temp', ('temp', 'Ufo temperature')),
-            ('mach', ('none', 'Ufo mach number')),
-            ('eflx', ('eflx', 'Ufo energy flux.')),
-            ('pratio', ('none', 'Pressure ratio (ufo/ISM).')),
-            ('dratio', ('none', 'Density ratio (ufo/ISM).')),
-            ('eint', ('eint', 'Ufo Specific internal energy')),
-            ('enth', ('eint', 'Ufo Specific enthalpy')),
-            ('pdot', ('pdot', 'Ufo Momentum injection rate.')),
-            ('pflx', ('pres', 'Ufo Momentum flux.')),
-        ])
+        self.defs = OrderedDict(self.variables)
 
         # Capture normalization object
         self.norm = norm
@@ -114,12 +145,13 @@ jj
         args['rufo'] = args['rufo'] * pc.kpc / getattr(self.norm, self.defs['rufo'][0])
         args['dens_ambient'] = args['dens_ambient'] * self.mua * pc.amu / getattr(self.norm, self.defs['dens_ambient'][0])
         args['temp_ambient'] = args['temp_ambient'] / getattr(self.norm, self.defs['temp_ambient'][0])
+        args['alpha'] = np.radians(args['angle'])
         self.__dict__.update(args)
         self.args = args
 
         # Create update functions for all variables, and update all 
         for var in self.defs:
-            if not args.has_key(var):
+            if var not in args:
                 setattr(self, 'upd_' + var, self.create_upd_fn(var))
                 getattr(self, 'upd_' + var)()
 
@@ -153,7 +185,7 @@ jj
         trialed at some point.
         """
         for var in self.defs:
-            if not self.args.has_key(var):
+            if var not in self.args:
                 getattr(self, 'upd_' + var)()
         self.update_all_dictionaries()
 
@@ -244,19 +276,19 @@ jj
         return np.sqrt(gamma * pres_ambient / dens_ambient)
 
     def eqn_area(self, rufo=None, alpha=None):
-        if rufo is None: rufo = self.rjet
-        if alpha is None: alpha = self.alpha
-        if alpha > 1.e-30:
-            return 2. * np.pi * (1. - np.cos(alpha)) * pow(rufo / np.sin(alpha), 2)
-        else:
-            return np.pi * rufo * rufo
-
+        """
+        Outflow area of the launch geometry, or of a spherical cap of
+        polar angle alpha (radians) if given.
+        """
+        if rufo is None: rufo = self.rufo
+        if alpha is not None:
+            return geo.SphericalCap(np.degrees(alpha)).area(rufo)
+        return self.geometry.area(rufo, pc.kpc / self.norm.x)
 
     def eqn_pres(self, power=None, speed=None, mdot=None, rufo=None, alpha=None, gamma=None):
         if power is None: power = self.power
         if speed is None: speed = self.speed
         if mdot is None: mdot = self.mdot
-        if alpha is None: alpha = self.alpha
         if rufo is None: rufo = self.rufo
         if gamma is None: gamma = self.gamma
 
@@ -265,7 +297,7 @@ jj
 
     def eqn_eflx(self, power=None, rufo=None, alpha=None):
         if power is None: power = self.power
-        if alpha is None: alpha = self.alpha
+        if rufo is None: rufo = self.rufo
         area = self.eqn_area(rufo, alpha)
         return power / area
 
@@ -273,7 +305,6 @@ jj
         if speed is None: speed = self.speed
         if mdot is None: mdot = self.mdot
         if rufo is None: rufo = self.rufo
-        if alpha is None: alpha = self.alpha
 
         area = self.eqn_area(rufo, alpha)
         return mdot / (area * speed)
@@ -283,7 +314,6 @@ jj
         if speed is None: speed = self.speed
         if mdot is None: mdot = self.mdot
         if rufo is None: rufo = self.rufo
-        if alpha is None: alpha = self.alpha
         if gamma is None: gamma = self.gamma
         if muu is None: muu = self.muu
 
@@ -297,7 +327,6 @@ jj
         if speed is None: speed = self.speed
         if mdot is None: mdot = self.mdot
         if rufo is None: rufo = self.rufo
-        if alpha is None: alpha = self.alpha
         if gamma is None: gamma = self.gamma
 
         pres = self.eqn_pres(power, speed, mdot, rufo, alpha, gamma)
@@ -312,7 +341,6 @@ jj
         if speed is None: speed = self.speed
         if mdot is None: mdot = self.mdot
         if rufo is None: rufo = self.rufo
-        if alpha is None: alpha = self.alpha
         if gamma is None: gamma = self.gamma
 
         vsnd = self.eqn_vsnd(power, speed, mdot, rufo, alpha, gamma)
@@ -336,7 +364,6 @@ jj
         if speed is None: speed = self.speed
         if mdot is None: mdot = self.mdot
         if rufo is None: rufo = self.rufo
-        if alpha is None: alpha = self.alpha
         if gamma is None: gamma = self.gamma
         if temp_ambient is None: temp_ambient = self.temp_ambient
         if dens_ambient is None: dens_ambient = self.dens_ambient
@@ -350,7 +377,6 @@ jj
         if speed is None: speed = self.speed
         if mdot is None: mdot = self.mdot
         if rufo is None: rufo = self.rufo
-        if alpha is None: alpha = self.alpha
         if dens_ambient is None: dens_ambient = self.dens_ambient
 
         dens = self.eqn_dens(speed, mdot, rufo, alpha)
@@ -375,7 +401,6 @@ jj
         if speed is None: speed = self.speed
         if mdot is None: mdot = self.mdot
         if rufo is None: rufo = self.rufo
-        if alpha is None: alpha = self.alpha
         if gamma is None: gamma = self.gamma
 
         pres = self.eqn_pres(power, speed, mdot, rufo, alpha, gamma)
@@ -401,7 +426,6 @@ jj
         if speed is None: speed = self.speed
         if mdot is None: mdot = self.mdot
         if rufo is None: rufo = self.rufo
-        if alpha is None: alpha = self.alpha
         if gamma is None: gamma = self.gamma
 
         pres = self.eqn_pres(power, speed, mdot, rufo, alpha, gamma)
@@ -424,7 +448,6 @@ jj
         if speed is None: speed = self.speed
         if mdot is None: mdot = self.mdot
         if rufo is None: rufo = self.rufo
-        if alpha is None: alpha = self.alpha
 
         area = self.eqn_area(rufo, alpha)
         pdot = self.eqn_pdot(speed, mdot)
@@ -432,4 +455,143 @@ jj
         return pdot / area
 
 
+# Variables of UfoParamsRel: those of UfoParams and the relativistic ones
+DEFS_REL = OrderedDict(list(DEFS.items()) + [
+    ('lorentz', ('none', 'Ufo Lorentz factor')),
+    ('dens_rel', ('dens', 'Ufo proper density (relativistic).')),
+    ('enth_rel', ('none', 'Ufo specific enthalpy incl. rest mass, in c^2 (relativistic).')),
+    ('theta_rel', ('none', 'Ufo pressure over proper density times c^2 (relativistic).')),
+    ('pres_rel', ('pres', 'Ufo pressure (relativistic).')),
+    ('temp_rel', ('temp', 'Ufo temperature (relativistic).')),
+    ('vsnd_rel', ('v', 'Ufo sound speed (relativistic).')),
+    ('power_kin', ('epwr', 'Ufo kinetic power (relativistic).')),
+    ('power_enth', ('epwr', 'Ufo enthalpy power excl. rest mass (relativistic).')),
+    ('cons_dens', ('dens', 'Ufo lab frame density D.')),
+    ('cons_mom', ('pden', 'Ufo lab frame momentum density S.')),
+    ('cons_ener', ('pres', 'Ufo lab frame energy density excl. rest mass, tau.')),
+])
+
+
+class UfoParamsRel(UfoParams):
+    """
+    UfoParams with the parameters of the relativistic ufo in addition to
+    those of the corresponding non-relativistic ufo. The ufo gas follows
+    the Taub-Matthews equation of state (eos.EOSTaubMatthews), and the
+    power, excluding the rest mass energy flux, is decomposed as
+
+        power = mdot c^2 (lorentz - 1) + mdot c^2 lorentz (enth_rel - 1)
+              = power_kin + power_enth
+
+    with mdot = lorentz dens_rel speed area. Given power, mdot and speed,
+    enth_rel follows directly, and theta_rel from the closed form inverse
+    of the equation of state, so the whole path is vectorized. The
+    conserved variables cons_* can be turned back into primitive variables
+    with eos.EOSTaubMatthews.prim_from_cons().
+
+    Parameters are those of UfoParams.
+    """
+
+    variables = DEFS_REL
+
+    def __init__(self, power=1.e44, angle=30, speed=0.03, mdot=0.1, rufo=0.1, dens_ambient=1.0, temp_ambient=1.e7,
+                 gamma=1.6666666666, norm=None, geometry=None):
+
+        if norm is None: norm = default_norm()
+
+        # Speed of light in code units
+        self.clight = pc.c / norm.v
+
+        # Create an EOS object for the relativistic ufo
+        self.eost = eos.EOSTaubMatthews(comp=CompositionUfo(), inorm=norm, onorm=norm)
+
+        UfoParams.__init__(self, power, angle, speed, mdot, rufo, dens_ambient, temp_ambient, gamma, norm, geometry)
+
+    def eqn_lorentz(self, speed=None):
+        if speed is None: speed = self.speed
+
+        beta = speed / self.clight
+        return 1. / np.sqrt(1. - beta * beta)
+
+    def eqn_dens_rel(self, speed=None, mdot=None, rufo=None, alpha=None):
+        if speed is None: speed = self.speed
+        if mdot is None: mdot = self.mdot
+        if rufo is None: rufo = self.rufo
+
+        area = self.eqn_area(rufo, alpha)
+        lorentz = self.eqn_lorentz(speed)
+        return mdot / (lorentz * area * speed)
+
+    def eqn_enth_rel(self, power=None, speed=None, mdot=None):
+        """
+        Dimensionless specific enthalpy, from
+        power = mdot c^2 (lorentz enth_rel - 1)
+        """
+        if power is None: power = self.power
+        if speed is None: speed = self.speed
+        if mdot is None: mdot = self.mdot
+
+        lorentz = self.eqn_lorentz(speed)
+        return (power / (mdot * self.clight ** 2) + 1.) / lorentz
+
+    def eqn_theta_rel(self, power=None, speed=None, mdot=None):
+        enth = self.eqn_enth_rel(power, speed, mdot)
+        return self.eost.theta_from_enth(enth)
+
+    def eqn_pres_rel(self, power=None, speed=None, mdot=None, rufo=None, alpha=None):
+        theta = self.eqn_theta_rel(power, speed, mdot)
+        dens = self.eqn_dens_rel(speed, mdot, rufo, alpha)
+        return theta * dens * self.clight ** 2
+
+    def eqn_temp_rel(self, power=None, speed=None, mdot=None, rufo=None, alpha=None, muu=None):
+        if muu is None: muu = self.muu
+
+        pres = self.eqn_pres_rel(power, speed, mdot, rufo, alpha)
+        dens = self.eqn_dens_rel(speed, mdot, rufo, alpha)
+        return self.eost.temp_from_dens_pres(dens, pres, muu)
+
+    def eqn_vsnd_rel(self, power=None, speed=None, mdot=None, rufo=None, alpha=None):
+        pres = self.eqn_pres_rel(power, speed, mdot, rufo, alpha)
+        dens = self.eqn_dens_rel(speed, mdot, rufo, alpha)
+        with np.errstate(invalid='ignore'):
+            return self.eost.vsnd_from_dens_pres(dens, pres)
+
+    def eqn_power_kin(self, speed=None, mdot=None):
+        if speed is None: speed = self.speed
+        if mdot is None: mdot = self.mdot
+
+        lorentz = self.eqn_lorentz(speed)
+        return mdot * self.clight ** 2 * (lorentz - 1.)
+
+    def eqn_power_enth(self, power=None, speed=None, mdot=None):
+        if speed is None: speed = self.speed
+        if mdot is None: mdot = self.mdot
+
+        lorentz = self.eqn_lorentz(speed)
+        enth = self.eqn_enth_rel(power, speed, mdot)
+        return mdot * self.clight ** 2 * lorentz * (enth - 1.)
+
+    def eqn_cons_dens(self, speed=None, mdot=None, rufo=None, alpha=None):
+        lorentz = self.eqn_lorentz(speed)
+        dens = self.eqn_dens_rel(speed, mdot, rufo, alpha)
+        return lorentz * dens
+
+    def eqn_cons_mom(self, power=None, speed=None, mdot=None, rufo=None, alpha=None):
+        if speed is None: speed = self.speed
+
+        lorentz = self.eqn_lorentz(speed)
+        dens = self.eqn_dens_rel(speed, mdot, rufo, alpha)
+        enth = self.eqn_enth_rel(power, speed, mdot)
+        return lorentz ** 2 * dens * enth * speed
+
+    def eqn_cons_ener(self, power=None, speed=None, mdot=None, rufo=None, alpha=None):
+        lorentz = self.eqn_lorentz(speed)
+        dens = self.eqn_dens_rel(speed, mdot, rufo, alpha)
+        enth = self.eqn_enth_rel(power, speed, mdot)
+        pres = self.eqn_pres_rel(power, speed, mdot, rufo, alpha)
+        return (lorentz ** 2 * enth - lorentz) * dens * self.clight ** 2 - pres
+
 
+# Opt-in instrumentation for the whole run, see instrument.py
+if os.environ.get('UFO_PROFILE', '0') not in ('', '0'):
+    import instrument
+    instrument.enable_from_env(os.environ['UFO_PROFILE'])
@@ -2,13 +2,11 @@
 
 # The sympy version. Totally not finished, barely begun.
 
-from sy.__future__ import division
 import physconst as pc
 import numpy as np
-import norm
 import eos
+import ufo_parameters
 from collections import OrderedDict
-import sympy as sy
 
 
 class CompositionUfo(eos.CompositionBase):
@@ -29,6 +27,25 @@ class CompositionISM(eos.CompositionBase):
         eos.CompositionBase.__init__(self, mu)
 
 
+# Sympy symbols of the variables
+SYMBOLS = OrderedDict([
+    ('power', 'P'), ('angle', 'phi'), ('speed', 'v'), ('mdot', 'm_t'), ('rufo', 'r'), ('wufo', 'w'),
+    ('temp_ambient', 'T_a'), ('dens_ambient', 'rho_a'), ('gamma', 'gamma'), ('pres_ambient', 'p_a'),
+    ('eint_ambient', 'epsilon_a'), ('vsnd_ambient', 'a_a'), ('area', 'A'), ('pres', 'p'), ('dens', 'rho'),
+    ('temp', 'T'), ('mach', 'M'), ('eflx', 'F'), ('pratio', 'xi'), ('dratio', 'zeta'), ('eint', 'epsilon'),
+    ('enth', 'h'), ('pdot', 'f_t'), ('pflx', 'f_A'), ('r1', 'r_1'), ('r2', 'r_2'), ('delta', 'Delta'),
+])
+
+# Variables that differ from, or are not in ufo_parameters.DEFS: (type of units, description)
+DEFS_SYM = OrderedDict([
+    ('angle', ('none', 'Angle of UFO with disc')),
+    ('wufo', ('x', 'Width of launching region')),
+    ('r1', ('x', 'Inner wind launching radius.')),
+    ('r2', ('x', 'Outer wind launching radius.')),
+    ('delta', ('x', 'w projected onto disc.')),
+])
+
+
 class UfoParams():
     """
     This class contains functions to calculate parameters of a relativistic ufo
@@ -48,8 +65,7 @@ class UfoParams():
                  gamma=1.6666666666,
                  pmode=0,
                  dmode=0,
-                 norm=norm.PhysNorm(x=pc.kpc, t=pc.kyr, dens=0.6165 * pc.amu,
-                                    temp=(pc.kpc / pc.kyr) ** 2 * pc.amu / pc.kboltz, curr=1)
+                 norm=None
     ):
         """
         Parameters
@@ -92,7 +108,8 @@ class UfoParams():
                                   medium. The mass outflow rate mdot is adjusted
 
 
-          norm                 Normalization object for internal calculations
+          norm                 Normalization object for internal calculations.
+                               Default ufo_parameters.default_norm().
 
         Internally, everything is then converted into and handled in units of
 
@@ -105,6 +122,11 @@ class UfoParams():
 
         """
 
+        # sympy is slow to import, so only do so when it's needed.
+        import sympy as sy
+
+        if norm is None: norm = ufo_parameters.default_norm()
+
         # All attributes in class are stored in dictionary
         # self.__dict__ whose update function can be used to 
         # append it with a list of local variables.
@@ -114,36 +136,12 @@ class UfoParams():
         # Dictionary of variable names that were given
         args = self.__dict__.copy()
 
-        # Dictionary of variable names, their type of units
-        self.defs = OrderedDict([
-            ('power', ('epwr', 'P', 'Ufo power')),
-            ('angle', ('none', 'phi', 'Angle of UFO with disc')),
-            ('speed', ('v', 'v', 'Ufo speed')),
-            ('mdot', ('mdot', 'm_t', 'Ufo mass outflow rate')),
-            ('rufo', ('x', 'r', 'Ufo radius')),
-            ('wufo', ('x', 'w', 'Width of launching region')),
-            ('temp_ambient', ('temp', 'T_a', 'Reference temperature of background ISM.')),
-            ('dens_ambient', ('dens', 'rho_a', 'Reference density of background ISM.')),
-            ('gamma', ('none', 'gamma', 'Adiabiatic index')),
-            ('pres_ambient', ('pres', 'p_a', 'Reference pressure of background ISM.')),
-            ('eint_ambient', ('eint', 'epsilon_a', 'Ambient internal energy')),
-            ('vsnd_ambient', ('v', 'a_a', 'Ambient sound speed')),
-            ('area', ('area', 'A', 'Outflow area')),
-            ('pres', ('pres', 'p', 'Ufo pressure')),
-            ('dens', ('dens', 'rho', 'Ufo density')),
-            ('temp', ('temp', 'T', 'Ufo temperature')),
-            ('mach', ('none', 'M', 'Ufo mach number')),
-            ('eflx', ('eflx', 'F', 'Ufo energy flux.')),
-            ('pratio', ('none', 'xi', 'Pressure ratio (ufo/ISM).')),
-            ('dratio', ('none', 'zeta', 'Density ratio (ufo/ISM).')),
-            ('eint', ('eint', 'epsilon', 'Ufo Specific internal energy')),
-            ('enth', ('eint', 'h', 'Ufo Specific enthalpy')),
-            ('pdot', ('pdot', 'f_t', 'Ufo Momentum injection rate.')),
-            ('pflx', ('pres', 'f_A', 'Ufo Momentum flux.')),
-            ('r1', ('x', 'r_1', 'Inner wind launching radius.')),
-            ('r2', ('x', 'r_2', 'Outer wind launching radius.')),
-            ('delta', ('x', 'Delta', 'w projected onto disc.'))
-        ])
+        # Dictionary of variable names, their type of units, symbol and
+        # description. Units are those of ufo_parameters.DEFS.
+        self.defs = OrderedDict()
+        for k, sym in SYMBOLS.items():
+            unit, desc = DEFS_SYM[k] if k in DEFS_SYM else ufo_parameters.DEFS[k]
+            self.defs[k] = (unit, sym, desc)
 
         # Capture normalization object
         self.norm = norm
@@ -0,0 +1,258 @@
+# Adaptive sampling of the UfoParams parameter space.
+#
+# A uniform grid of cells over a few input parameters is refined
+# recursively where outputs cross a threshold (by default mach = 1,
+# pratio = 1 and pres = 0, where the kinetic power exceeds the total
+# power) or vary by more than a given fraction across a cell. The
+# outputs are evaluated at the cell corners. Every refinement level,
+# i.e. all new corners of all cells split at that level, is one batch
+# of the fused kernel.
+#
+# Corners live on an integer lattice of the finest level, so corners
+# shared by neighbouring cells and by cells of different levels are only
+# evaluated once.
+#
+#   s = AdaptiveSampler(OrderedDict([('power', (1.e42, 1.e46, 'log')),
+#                                    ('speed', (0.01, 0.3))]), max_level=6).run()
+#   s.points['power'], s.outputs['mach'], s.level, ...
+
+from collections import OrderedDict
+
+import numpy as np
+
+import ufo_kernels as uk
+
+# Default thresholds of refinement
+THRESHOLDS = OrderedDict([('mach', 1.), ('pratio', 1.), ('pres', 0.)])
+
+
+class Sampling():
+    """
+    Point cloud and cell tree of an adaptive sampling.
+
+    Points, one per evaluated cell corner:
+      ijk           Position on the integer lattice, shape (npoints, ndim).
+      points        OrderedDict of the sampled input parameters.
+      outputs       OrderedDict of all UfoParams variables.
+      level         Refinement level at which the point was added.
+      cell          Index of the cell whose split added the point, or -1
+                    for the points of the base grid.
+
+    Cells, in order of creation:
+      cell_level    Refinement level.
+      cell_lo       Lowest corner on the integer lattice, shape (ncells, ndim).
+      cell_size     Edge length on the integer lattice.
+      cell_parent   Index of the parent cell, or -1.
+      cell_reason   Bit mask of the criteria (see criteria) that flagged
+                    the cell, 0 if none did.
+      cell_split    Whether the cell was split.
+
+    criteria        Names of the criteria, e.g. 'mach=1' or 'eflx~0.5'.
+    lattice         Number of lattice intervals per parameter.
+    """
+
+    def __init__(self, names, lattice, criteria):
+        self.names = tuple(names)
+        self.lattice = lattice
+        self.criteria = list(criteria)
+
+    def leaves(self):
+        """
+        Indices of the cells that were not split.
+        """
+        return np.flatnonzero(~self.cell_split)
+
+    def flagged(self, criterion=None):
+        """
+        Indices of the cells flagged by criterion (a name of
+        self.criteria), or by any criterion.
+        """
+        mask = ~0 if criterion is None else 1 << self.criteria.index(criterion)
+        return np.flatnonzero(self.cell_reason & mask)
+
+
+class AdaptiveSampler():
+    """
+    Adaptive sampling of UfoParams outputs over ranges of input
+    parameters.
+    """
+
+    def __init__(self, ranges, base=4, max_level=4, thresholds=None, variation=None, units='code', norm=None,
+                 block=16384, **fixed):
+        """
+        ranges          OrderedDict of input parameter name to (low, high),
+                        or (low, high, 'log') for logarithmic sampling.
+        base            Number of cells of the base grid per parameter.
+        max_level       Number of refinement levels.
+        thresholds      Mapping of output name to threshold value. Cells
+                        across which an output crosses its threshold are
+                        refined. Default THRESHOLDS.
+        variation       Mapping of output name to a fraction. Cells across
+                        which (max - min) / max(|max|, |min|) of an output
+                        exceeds it are refined. Default none.
+        units           'code' or 'cgs', the units of the outputs.
+        norm            Normalization of code units. Default UfoParams'.
+        block           Number of parameter sets per kernel block.
+        fixed           Further input parameters, scalars. Missing ones
+                        take the UfoParams defaults.
+        """
+        for k in list(ranges) + list(fixed):
+            if k not in uk.INPUTS:
+                raise ValueError('Error, Unknown parameter ' + k + '.')
+        if thresholds is None: thresholds = THRESHOLDS
+        if variation is None: variation = {}
+        for k in list(thresholds) + list(variation):
+            if k not in uk.OUTPUTS:
+                raise ValueError('Error, Unknown output ' + k + '.')
+
+        self.names = tuple(ranges)
+        self.lo = np.array([r[0] for r in ranges.values()], dtype=float)
+        self.hi = np.array([r[1] for r in ranges.values()], dtype=float)
+        self.log = np.array([len(r) > 2 and r[2] == 'log' for r in ranges.values()])
+        if np.any(self.log & (self.lo <= 0.)):
+            raise ValueError('Logarithmic ranges must be positive.')
+        self.lo[self.log] = np.log10(self.lo[self.log])
+        self.hi[self.log] = np.log10(self.hi[self.log])
+
+        self.base = base
+        self.max_level = max_level
+        self.thresholds = OrderedDict(thresholds)
+        self.variation = OrderedDict(variation)
+        self.criteria = ([k + '=' + repr(v) for k, v in self.thresholds.items()] +
+                         [k + '~' + repr(v) for k, v in self.variation.items()])
+        self.units = units
+        self.fixed = fixed
+        self.kernel = uk.Kernel(norm, block)
+
+        # Lattice of the finest level
+        self.ndim = len(self.names)
+        self.lattice = base << max_level
+        self.corners = np.array(np.meshgrid(*[[0, 1]] * self.ndim, indexing='ij')).reshape(self.ndim, -1).T
+
+    def keys(self, ijk):
+        """
+        Unique integer keys of lattice points ijk, shape (..., ndim).
+        """
+        return np.ravel_multi_index(tuple(np.moveaxis(ijk, -1, 0)), (self.lattice + 1,) * self.ndim)
+
+    def params(self, ijk):
+        """
+        Input parameters of lattice points ijk, shape (n, ndim).
+        """
+        x = self.lo + (self.hi - self.lo) * ijk / self.lattice
+        x[:, self.log] = 10 ** x[:, self.log]
+        return OrderedDict((k, x[:, i]) for i, k in enumerate(self.names))
+
+    def evaluate(self, ijk):
+        """
+        All outputs at lattice points ijk, as one batch.
+        """
+        return self.kernel.evaluate(units=self.units, **dict(self.fixed, **self.params(ijk)))
+
+    def flag(self, outputs, idx):
+        """
+        Bit mask of the criteria met by cells with corner points idx,
+        shape (ncells, 2^ndim).
+        """
+        reason = np.zeros(len(idx), dtype=np.int64)
+        bit = 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for k, thr in self.thresholds.items():
+                v = outputs[k][idx]
+                hit = np.any(v >= thr, axis=1) & np.any(v < thr, axis=1)
+                reason |= hit.astype(np.int64) << bit
+                bit += 1
+            for k, tol in self.variation.items():
+                v = outputs[k][idx]
+                vmin, vmax = v.min(axis=1), v.max(axis=1)
+                hit = (vmax - vmin) > tol * np.maximum(np.abs(vmin), np.abs(vmax))
+                reason |= hit.astype(np.int64) << bit
+                bit += 1
+        return reason
+
+    def run(self):
+        """
+        Sample the parameter space. Returns a Sampling.
+        """
+        nd = self.ndim
+        size = 1 << self.max_level
+
+        # Base grid of cells and its corner points
+        lo = np.array(np.meshgrid(*[np.arange(self.base) * size] * nd, indexing='ij')).reshape(nd, -1).T
+        ijk = np.array(np.meshgrid(*[np.arange(self.base + 1) * size] * nd, indexing='ij')).reshape(nd, -1).T
+
+        pts_ijk = [ijk]
+        pts_level = [np.zeros(len(ijk), dtype=np.int16)]
+        pts_cell = [np.full(len(ijk), -1, dtype=np.int64)]
+        out = [self.evaluate(ijk)]
+        keys = self.keys(ijk)
+
+        cells_lo = [lo]
+        cells_level = [np.zeros(len(lo), dtype=np.int16)]
+        cells_parent = [np.full(len(lo), -1, dtype=np.int64)]
+        cells_reason = []
+        cells_split = []
+        ncells = len(lo)
+        level_start = 0
+
+        for level in range(self.max_level + 1):
+            # Outputs at the corners of the cells of this level
+            outputs = OrderedDict((k, np.concatenate([o[k] for o in out])) for k in uk.OUTPUTS)
+            order = np.argsort(keys)
+            corner_keys = self.keys(lo[:, None, :] + size * self.corners[None, :, :])
+            idx = order[np.searchsorted(keys, corner_keys, sorter=order)]
+
+            reason = self.flag(outputs, idx)
+            split = (reason != 0) & (level < self.max_level)
+            cells_reason.append(reason)
+            cells_split.append(split)
+            if not split.any():
+                break
+
+            # Children of the flagged cells
+            parents = np.flatnonzero(split) + level_start
+            size //= 2
+            lo = (lo[split][:, None, :] + size * self.corners[None, :, :]).reshape(-1, nd)
+            parent = np.repeat(parents, len(self.corners))
+
+            # Their corners that are new
+            ijk = (lo[:, None, :] + size * self.corners[None, :, :]).reshape(-1, nd)
+            cell = np.repeat(np.arange(len(lo)), len(self.corners))
+            new_keys, first = np.unique(self.keys(ijk), return_index=True)
+            new = ~np.isin(new_keys, keys)
+            ijk = ijk[first[new]]
+
+            pts_ijk.append(ijk)
+            pts_level.append(np.full(len(ijk), level + 1, dtype=np.int16))
+            pts_cell.append(parent[cell[first[new]]])
+            out.append(self.evaluate(ijk))
+            keys = np.concatenate([keys, new_keys[new]])
+
+            level_start = ncells
+            ncells += len(lo)
+            cells_lo.append(lo)
+            cells_level.append(np.full(len(lo), level + 1, dtype=np.int16))
+            cells_parent.append(parent)
+
+        s = Sampling(self.names, self.lattice, self.criteria)
+        ijk = np.concatenate(pts_ijk)
+        s.ijk = ijk
+        s.points = self.params(ijk)
+        s.outputs = OrderedDict((k, np.concatenate([o[k] for o in out])) for k in uk.OUTPUTS)
+        s.level = np.concatenate(pts_level)
+        s.cell = np.concatenate(pts_cell)
+        s.cell_lo = np.concatenate(cells_lo)
+        s.cell_level = np.concatenate(cells_level)
+        s.cell_size = (1 << self.max_level) >> s.cell_level
+        s.cell_parent = np.concatenate(cells_parent)
+        s.cell_reason = np.concatenate(cells_reason)
+        s.cell_split = np.concatenate(cells_split)
+        return s
+
+
+def refine(ranges, base=4, max_level=4, thresholds=None, variation=None, units='code', norm=None, **fixed):
+    """
+    Adaptive sampling of UfoParams outputs, see AdaptiveSampler.
+    Returns a Sampling.
+    """
+    return AdaptiveSampler(ranges, base, max_level, thresholds, variation, units, norm, **fixed).run()
@@ -0,0 +1,362 @@
+# Persistent calculation server for UfoParams.
+#
+# A long-running asyncio server listening on a Unix domain socket. Numpy,
+# norm and eos are imported, and normalizations constructed, only once.
+# Concurrent requests are combined into one vectorized UfoParams
+# evaluation. Use ufo_client.py to talk to it.
+#
+# Protocol: every request is one line of JSON, optionally followed by a
+# binary payload; every reply is one line of JSON, optionally followed by
+# a binary payload.
+#
+#   JSON request    {"id": 1, "params": {"power": 1e44, "speed": [0.01, 0.02]},
+#                    "vars": [...], "units": ["code", "cgs"], "norm": {...}}
+#   JSON reply      {"id": 1, "code": {var: value(s)}, "cgs": {var: value(s)}}
+#
+#   Binary request  {"id": 1, "params": ["power", "speed"], "rows": n, ...}
+#                   followed by n float64 (little-endian) values per parameter,
+#                   parameter after parameter.
+#   Binary reply    {"id": 1, "rows": n, "columns": ["code:power", ...]}
+#                   followed by n float64 values per column.
+#
+#   Statistics      {"id": 1, "op": "stats"}  ->  {"id": 1, "stats": {...}}
+#
+# A binary request with an invalid "rows" or "params" gets an error reply
+# and the connection is closed, as the length of its payload is unknown.
+# "rows" is at most the batch size of the server.
+#
+# "vars" defaults to all of UfoParams.defs, "units" to both, and "norm"
+# (PhysNorm keyword arguments) to the UfoParams default normalization.
+
+import asyncio
+import inspect
+import json
+import os
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+import norm
+import ufo_client
+import ufo_parameters as up
+
+# Input parameters of UfoParams and their defaults
+_sig = inspect.signature(up.UfoParams.__init__)
+INPUTS = OrderedDict((k, v.default) for k, v in _sig.parameters.items() if k not in ('self', 'norm', 'geometry'))
+
+UNITS = ('code', 'cgs')
+
+
+class _Request():
+    """
+    One request waiting in the batch queue.
+    """
+
+    __slots__ = ('params', 'rows', 'scalar', 'vars', 'units', 'norm_key', 'future', 't0')
+
+    def __init__(self, params, rows, scalar, vars, units, norm_key, future):
+        self.params = params
+        self.rows = rows
+        self.scalar = scalar
+        self.vars = vars
+        self.units = units
+        self.norm_key = norm_key
+        self.future = future
+        self.t0 = time.perf_counter()
+
+
+class UfoServer():
+    """
+    Asyncio server evaluating UfoParams for many clients.
+
+    Requests arriving within max_delay seconds of each other are evaluated
+    as one batch (up to max_batch rows). Normalizations are cached by
+    their keyword arguments, and results of single-row requests are kept
+    in an LRU cache of cache_size entries. Batches are evaluated one at a
+    time in a worker thread, so the event loop keeps accepting requests
+    and answering stats meanwhile.
+    """
+
+    def __init__(self, path=None, max_batch=1 << 20, max_delay=0.002, cache_size=4096):
+        self.path = ufo_client.DEFAULT_SOCKET if path is None else path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.cache_size = cache_size
+
+        self.queue = asyncio.Queue()
+        self.norms = {None: up.default_norm()}
+        self.cache = OrderedDict()
+        self.defs = up.UfoParams().defs
+
+        # Counters
+        self.t_start = time.time()
+        self.counters = OrderedDict([
+            ('requests', 0),
+            ('rows', 0),
+            ('batches', 0),
+            ('errors', 0),
+            ('cache_hits', 0),
+            ('cache_misses', 0),
+            ('eval_time', 0.),
+        ])
+        self.latencies = deque(maxlen=10000)
+        self.server = None
+
+    async def start(self):
+        """
+        Start listening on the socket and processing batches.
+        """
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.batcher = asyncio.ensure_future(self._batcher())
+        self.server = await asyncio.start_unix_server(self._handle, path=self.path)
+        return self.server
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.batcher.cancel()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def stats(self):
+        """
+        Latency (s) and throughput (rows/s) statistics since start.
+        """
+        stats = OrderedDict(self.counters)
+        uptime = time.time() - self.t_start
+        stats['uptime'] = uptime
+        stats['throughput'] = self.counters['rows'] / uptime if uptime > 0 else 0.
+        stats['mean_batch_rows'] = self.counters['rows'] / max(self.counters['batches'], 1)
+        if self.latencies:
+            lat = np.array(self.latencies)
+            stats['latency_mean'] = lat.mean()
+            stats['latency_p50'] = np.percentile(lat, 50)
+            stats['latency_p99'] = np.percentile(lat, 99)
+            stats['latency_max'] = lat.max()
+        return stats
+
+    def get_norm(self, kwargs):
+        """
+        Cached PhysNorm for a dictionary of keyword arguments.
+        """
+        if not kwargs:
+            return None
+        key = tuple(sorted(kwargs.items()))
+        if key not in self.norms:
+            self.norms[key] = norm.PhysNorm(**kwargs)
+        return key
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    header = json.loads(line)
+                    if not isinstance(header, dict):
+                        raise ValueError('Request must be a JSON object.')
+                except ValueError as e:
+                    # Malformed line, reply with the error and go on with the next
+                    self.counters['errors'] += 1
+                    reply, payload = OrderedDict([('id', None), ('error', str(e))]), b''
+                else:
+                    reply, payload = await self._dispatch(header, reader)
+                writer.write(json.dumps(reply).encode() + b'\n' + (payload or b''))
+                await writer.drain()
+                if payload is None:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, header, reader):
+        reply = OrderedDict(id=header.get('id'))
+
+        if header.get('op') == 'stats':
+            reply['stats'] = self.stats()
+            return reply, b''
+
+        binary = 'rows' in header
+        try:
+            if binary:
+                rows = header['rows']
+                names = header.get('params')
+                if isinstance(rows, bool) or not isinstance(rows, int) or not 0 <= rows <= self.max_batch:
+                    raise ValueError('rows must be an integer from 0 to ' + str(self.max_batch) + '.')
+                if not isinstance(names, list) or not all(isinstance(k, str) and k in INPUTS for k in names):
+                    raise ValueError('params must be a list of parameter names.')
+                if len(set(names)) != len(names):
+                    raise ValueError('Duplicate parameter names.')
+        except ValueError as e:
+            # The length of the payload is unknown, the connection is closed
+            self.counters['errors'] += 1
+            reply['error'] = str(e)
+            return reply, None
+
+        if binary:
+            data = np.frombuffer(await reader.readexactly(8 * rows * len(names)), dtype='<f8')
+            params = dict(zip(names, data.reshape(len(names), rows)))
+        else:
+            params = header.get('params', {})
+
+        try:
+            vars = header.get('vars', list(self.defs))
+            units = header.get('units', list(UNITS))
+            for k in params:
+                if k not in INPUTS:
+                    raise ValueError('Unknown parameter ' + k + '.')
+            for k in vars:
+                if k not in self.defs:
+                    raise ValueError('Unknown variable ' + k + '.')
+            for u in units:
+                if u not in UNITS:
+                    raise ValueError('Unknown units ' + u + '.')
+            norm_key = self.get_norm(header.get('norm'))
+
+            scalar = not binary and all(np.ndim(v) == 0 for v in params.values())
+            if scalar:
+                cache_key = (norm_key, tuple(sorted(params.items())), tuple(vars), tuple(units))
+                result = self.cache.get(cache_key)
+                if result is not None:
+                    self.cache.move_to_end(cache_key)
+                    self.counters['cache_hits'] += 1
+                    self.counters['requests'] += 1
+                    reply.update(result)
+                    return reply, b''
+                self.counters['cache_misses'] += 1
+
+            cols = np.broadcast_arrays(*[np.atleast_1d(np.asarray(v, dtype=float)) for v in params.values()])
+            rows = cols[0].size if cols else 1
+            cols = dict((k, c.ravel()) for k, c in zip(params, cols))
+
+            future = asyncio.get_running_loop().create_future()
+            await self.queue.put(_Request(cols, rows, scalar, vars, units, norm_key, future))
+            result = await future
+        except Exception as e:
+            self.counters['errors'] += 1
+            reply['error'] = str(e)
+            return reply, b''
+
+        if binary:
+            reply['rows'] = rows
+            reply['columns'] = [u + ':' + k for u in units for k in vars]
+            payload = b''.join(np.ascontiguousarray(result[u][k], dtype='<f8').tobytes()
+                               for u in units for k in vars)
+            return reply, payload
+
+        if scalar:
+            result = dict((u, OrderedDict((k, float(v[0])) for k, v in result[u].items())) for u in units)
+            self.cache[cache_key] = result
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        else:
+            result = dict((u, OrderedDict((k, v.tolist()) for k, v in result[u].items())) for u in units)
+        reply.update(result)
+        return reply, b''
+
+    async def _batcher(self):
+        """
+        Collect requests for up to max_delay seconds and evaluate them
+        together, one UfoParams evaluation per normalization.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            rows = batch[0].rows
+            deadline = loop.time() + self.max_delay
+            while rows < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    req = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(req)
+                rows += req.rows
+
+            groups = OrderedDict()
+            for req in batch:
+                groups.setdefault(req.norm_key, []).append(req)
+            for norm_key, reqs in groups.items():
+                # Evaluate in a worker thread, so the loop keeps serving other connections
+                t0 = time.perf_counter()
+                try:
+                    p = await loop.run_in_executor(None, self._evaluate, norm_key, reqs)
+                except Exception as e:
+                    # Counted as errors by each request in _dispatch
+                    for r in reqs:
+                        if not r.future.done():
+                            r.future.set_exception(e)
+                    continue
+                self._reply(p, reqs, t0)
+
+    def _evaluate(self, norm_key, reqs):
+        """
+        Evaluate a group of requests sharing a normalization as one batch.
+        Runs in a worker thread.
+        """
+        cols = {}
+        for k, default in INPUTS.items():
+            cols[k] = np.concatenate([r.params[k] if k in r.params else np.full(r.rows, default) for r in reqs])
+        return up.UfoParams(norm=self.norms[norm_key], **cols)
+
+    def _reply(self, p, reqs, t0):
+        """
+        Hand each request of a batch evaluated into p its slice of the
+        results.
+        """
+        t1 = time.perf_counter()
+        self.counters['batches'] += 1
+        self.counters['eval_time'] += t1 - t0
+
+        i0 = 0
+        for r in reqs:
+            sl = slice(i0, i0 + r.rows)
+            i0 += r.rows
+            result = {}
+            for u in r.units:
+                d = p.vars_code if u == 'code' else p.vars_cgs
+                result[u] = OrderedDict((k, d[k][sl]) for k in r.vars)
+            self.counters['requests'] += 1
+            self.counters['rows'] += r.rows
+            self.latencies.append(t1 - r.t0)
+            if not r.future.done():
+                r.future.set_result(result)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Persistent UfoParams calculation server.')
+    parser.add_argument('--socket', default=ufo_client.DEFAULT_SOCKET, help='Path of the Unix domain socket.')
+    parser.add_argument('--max-batch', type=int, default=1 << 20, help='Maximum number of rows per batch.')
+    parser.add_argument('--max-delay', type=float, default=0.002, help='Batching window (s).')
+    parser.add_argument('--cache-size', type=int, default=4096, help='Number of cached single-row results.')
+    args = parser.parse_args()
+
+    async def run():
+        server = UfoServer(args.socket, args.max_batch, args.max_delay, args.cache_size)
+        try:
+            await server.serve_forever()
+        finally:
+            server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
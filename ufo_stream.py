@@ -0,0 +1,384 @@
+# Streaming batch evaluation of UfoParams.
+#
+# Parameter records are read in chunks from CSV, JSONL or .npy files (or
+# stdin), each chunk is evaluated as one vectorized UfoParams and written
+# out before the next chunk is read, so tables of any length can be piped
+# through with memory bounded by the chunk size.
+
+import itertools
+import json
+import struct
+import sys
+
+import numpy as np
+
+import physconst as pc
+import norm
+import ufo_parameters as up
+import ufo_kernels as uk
+
+FORMATS = ('csv', 'jsonl', 'npy')
+
+
+def guess_format(path, default='csv'):
+    """
+    File format from the file name extension.
+    """
+    for fmt in FORMATS:
+        if path.endswith('.' + fmt):
+            return fmt
+    if path.endswith('.json'):
+        return 'jsonl'
+    return default
+
+
+def parse_value(s):
+    """
+    Parse a scaling value such as '3.0856775807e21', 'kpc', or
+    '0.6165*amu' or 'kpc/kyr', where names are constants in physconst.
+    """
+    val = 1.
+    op = '*'
+    for tok in s.replace('*', ' * ').replace('/', ' / ').split():
+        if tok in ('*', '/'):
+            op = tok
+            continue
+        try:
+            v = float(tok)
+        except ValueError:
+            if not hasattr(pc, tok):
+                raise ValueError('Error, Unknown constant ' + tok + '.')
+            v = getattr(pc, tok)
+        val = val * v if op == '*' else val / v
+    return val
+
+
+def parse_norm(items):
+    """
+    PhysNorm from a list of 'key=value' strings, or None if empty.
+    """
+    if not items:
+        return None
+    kwargs = {}
+    for item in items:
+        k, v = item.split('=', 1)
+        kwargs[k] = parse_value(v)
+    return norm.PhysNorm(**kwargs)
+
+
+def read_csv(f, chunk, delimiter=','):
+    """
+    Generator of dictionaries of column arrays of at most chunk rows
+    from a CSV file object with a header line.
+    """
+    names = [n.strip() for n in f.readline().strip().split(delimiter)]
+    while True:
+        lines = list(itertools.islice(f, chunk))
+        if not lines:
+            return
+        data = np.loadtxt(lines, delimiter=delimiter, ndmin=2)
+        yield dict((n, data[:, i]) for i, n in enumerate(names))
+
+
+def read_jsonl(f, chunk):
+    """
+    Generator of dictionaries of column arrays of at most chunk rows
+    from a file object with one JSON object per line.
+    """
+    while True:
+        records = [json.loads(l) for l in itertools.islice(f, chunk) if l.strip()]
+        if not records:
+            return
+        yield dict((k, np.array([r[k] for r in records], dtype=float)) for k in records[0])
+
+
+def read_npy(path, chunk):
+    """
+    Generator of dictionaries of column arrays of at most chunk rows
+    from a structured .npy file, which is memory mapped.
+    """
+    data = np.load(path, mmap_mode='r')
+    if data.dtype.names is None:
+        raise ValueError('Input .npy file must contain a structured array.')
+    for i0 in range(0, data.shape[0], chunk):
+        block = data[i0:i0 + chunk]
+        yield dict((k, np.asarray(block[k], dtype=float)) for k in data.dtype.names)
+
+
+def _write_rows(f, fmt, data):
+    """
+    Write rows of data formatted with the row format string fmt. Faster
+    than np.savetxt, which formats and writes row by row.
+    """
+    f.write('\n'.join([fmt % tuple(r) for r in data.tolist()]) + '\n')
+
+
+def float_format(dtype):
+    """
+    Text format of values of dtype with all their significant digits.
+    """
+    return '%.8e' if np.dtype(dtype).itemsize >= 8 else '%.6e'
+
+
+def column_dtypes(names, dtype):
+    """
+    List of the types of columns names, from a type, a list of types,
+    or a mapping of name to type.
+    """
+    if hasattr(dtype, 'items'):
+        return [np.dtype(dtype[n]) for n in names]
+    if isinstance(dtype, (list, tuple)):
+        return [np.dtype(t) for t in dtype]
+    return [np.dtype(dtype)] * len(names)
+
+
+class CSVWriter():
+    def __init__(self, f, names, delimiter=',', dtype=float):
+        self.f = f
+        self.dtypes = column_dtypes(names, dtype)
+        self.fmt = delimiter.join(float_format(t) for t in self.dtypes)
+        self.f.write(delimiter.join(names) + '\n')
+
+    def write(self, data):
+        _write_rows(self.f, self.fmt, data)
+
+    def close(self):
+        self.f.flush()
+
+
+class JSONLWriter():
+    """
+    Writes one JSON object per row. Non-finite values, which JSON cannot
+    represent, are written as null.
+    """
+
+    def __init__(self, f, names, dtype=float):
+        self.f = f
+        self.keys = ['"' + n + '": ' for n in names]
+        self.dtypes = column_dtypes(names, dtype)
+        self.fmts = [float_format(t) for t in self.dtypes]
+        self.fmt = '{' + ', '.join(k + f for k, f in zip(self.keys, self.fmts)) + '}'
+
+    def _row(self, r):
+        return '{' + ', '.join(k + (f % v if np.isfinite(v) else 'null')
+                               for k, f, v in zip(self.keys, self.fmts, r)) + '}'
+
+    def write(self, data):
+        finite = np.isfinite(data).all(axis=1)
+        if finite.all():
+            _write_rows(self.f, self.fmt, data)
+        else:
+            fmt = self.fmt
+            self.f.write('\n'.join([fmt % tuple(r) if ok else self._row(r)
+                                    for r, ok in zip(data.tolist(), finite.tolist())]) + '\n')
+
+    def close(self):
+        self.f.flush()
+
+
+class NPYWriter():
+    """
+    Writes a structured .npy file with one float field per variable.
+    The number of rows is not known beforehand, so the header is written
+    with a fixed size and rewritten with the final shape on close.
+    The file object must be seekable.
+    """
+
+    def __init__(self, f, names, dtype=float):
+        self.f = f
+        self.dtypes = column_dtypes(names, dtype)
+        self.dtype = np.dtype([(n, t) for n, t in zip(names, self.dtypes)])
+        self.rows = 0
+
+        # Reserve room for the largest possible row count, aligned to 64 bytes
+        self.header_len = 64 * ((10 + len(self._header(2 ** 63)) + 1 + 63) // 64)
+        self._write_header()
+
+    def _header(self, rows):
+        return repr({'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False, 'shape': (rows,)})
+
+    def _write_header(self):
+        header = self._header(self.rows)
+        nfill = self.header_len - 10 - len(header) - 1
+        self.f.seek(0)
+        self.f.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', self.header_len - 10) +
+                     (header + ' ' * nfill + '\n').encode('latin1'))
+        self.f.seek(0, 2)
+
+    def write(self, data):
+        rec = np.empty(data.shape[0], dtype=self.dtype)
+        for i, n in enumerate(self.dtype.names):
+            rec[n] = data[:, i]
+        self.f.write(rec.tobytes())
+        self.rows += data.shape[0]
+
+    def close(self):
+        self._write_header()
+        self.f.flush()
+
+
+def open_reader(path, fmt, chunk):
+    if fmt == 'npy':
+        if path == '-':
+            raise ValueError('.npy input cannot be read from stdin.')
+        return read_npy(path, chunk)
+    f = sys.stdin if path == '-' else open(path, 'r')
+    if fmt == 'csv':
+        return read_csv(f, chunk)
+    return read_jsonl(f, chunk)
+
+
+def open_writer(path, fmt, names, dtype=float):
+    if fmt == 'npy':
+        if path == '-':
+            raise ValueError('.npy output cannot be written to stdout.')
+        return NPYWriter(open(path, 'wb'), names, dtype)
+    f = sys.stdout if path == '-' else open(path, 'w')
+    if fmt == 'csv':
+        return CSVWriter(f, names, dtype=dtype)
+    return JSONLWriter(f, names, dtype)
+
+
+def evaluate_chunk(chunk, columns=None, norm=None, units='cgs'):
+    """
+    Evaluate UfoParams for one chunk of input columns. Returns the
+    dictionary of all variables in units. Columns named in columns must
+    be in the chunk.
+    """
+    if columns is None: columns = {}
+    kwargs = {} if norm is None else {'norm': norm}
+
+    for k, col in columns.items():
+        if col not in chunk:
+            raise ValueError('Error, column ' + col + ' of parameter ' + k + ' is not in the input.')
+
+    params = {}
+    for k in uk.INPUTS:
+        col = columns.get(k, k)
+        if col in chunk:
+            params[k] = chunk[col]
+    p = up.UfoParams(**dict(params, **kwargs))
+    return p.vars_cgs if units == 'cgs' else p.vars_code
+
+
+def evaluate_stream(reader, writer, vars, units='cgs', columns=None, norm=None, dtype=float, report=None):
+    """
+    Evaluate UfoParams chunk by chunk.
+
+    reader          Iterable of dictionaries of input column arrays.
+    writer          Object with write(array) taking an (n, len(vars)) array.
+    vars            Names of the output variables (keys of UfoParams.defs).
+    units           'cgs' or 'code'.
+    columns         Dictionary mapping UfoParams input parameters to input
+                    column names, which must exist in the input. Parameters
+                    that are not mapped are read from the column of the same
+                    name, or left at their UfoParams default if there is none.
+    norm            PhysNorm for the output (and internal) units.
+    dtype           Type the results are stored in, or a mapping of
+                    variable name to type (see ufo_kernels.storage_dtypes()).
+                    They are calculated in float64 regardless. Values out of
+                    the range of their type raise OverflowError before
+                    the chunk is written.
+    report          ufo_kernels.PrecisionReport to record the accuracy
+                    lost by rounding to dtype.
+
+    Returns the number of rows evaluated.
+    """
+    dtypes = column_dtypes(vars, dtype)
+
+    rows = 0
+    for chunk in reader:
+        n = len(next(iter(chunk.values())))
+        write_chunk(writer, evaluate_chunk(chunk, columns, norm, units), n, vars, dtypes, report)
+        rows += n
+    return rows
+
+
+def write_chunk(writer, d, n, vars, dtypes, report=None):
+    """
+    Write variables vars of the n rows of results d, e.g. from
+    evaluate_chunk(), with writer, rounded to the list of types dtypes.
+    Values out of the range of their type raise OverflowError before
+    anything is written.
+    """
+    out = np.empty((n, len(vars)))
+    for i, (k, t) in enumerate(zip(vars, dtypes)):
+        out[:, i] = d[k]
+        if t == np.float64:
+            continue
+        if not uk.in_range(out[:, i], t):
+            raise OverflowError('Error, values of ' + k + ' are out of the range of ' + t.name + '.')
+        stored = out[:, i].astype(t)
+        if report is not None:
+            report.update(k, out[:, i], stored)
+        out[:, i] = stored
+    writer.write(out)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Evaluate UfoParams for a stream of parameter records.',
+        epilog='Input columns are UfoParams parameters in the units of UfoParams '
+               '(power in erg/s, speed in c, mdot in Msun/yr, ...).')
+    parser.add_argument('input', help="Input file (.csv, .jsonl, .npy), or '-' for stdin.")
+    parser.add_argument('-o', '--output', default='-', help="Output file (.csv, .jsonl, .npy), or '-' for stdout.")
+    parser.add_argument('--input-format', choices=FORMATS, help='Input format. Default from file name, else csv.')
+    parser.add_argument('--output-format', choices=FORMATS, help='Output format. Default from file name, else csv.')
+    parser.add_argument('--map', nargs='*', default=[], metavar='PARAM=COLUMN',
+                        help='Read UfoParams parameter PARAM from input column COLUMN.')
+    parser.add_argument('--vars', nargs='*', help='Output variables. Default all.')
+    parser.add_argument('--units', choices=('cgs', 'code'), default='cgs', help='Units of the output.')
+    parser.add_argument('--norm', nargs='*', metavar='KEY=VALUE',
+                        help='PhysNorm scalings of code units, e.g. x=kpc t=kyr dens=0.6165*amu '
+                             'temp=1.0e5 curr=1. Values can be numbers or physconst names.')
+    parser.add_argument('--chunk', type=int, default=100000, help='Rows per evaluated chunk.')
+    parser.add_argument('--dtype', choices=('float64', 'float32'), default='float64',
+                        help='Precision of the output. Calculations are always done in float64.')
+    parser.add_argument('--precision-report', action='store_true',
+                        help='Print the accuracy lost by the output precision per variable to stderr.')
+    args = parser.parse_args(argv)
+
+    columns = {}
+    for item in args.map:
+        k, v = item.split('=', 1)
+        if k not in uk.INPUTS:
+            parser.error('Unknown parameter ' + k + '.')
+        columns[k] = v
+
+    nrm = parse_norm(args.norm)
+    vars = args.vars or list(up.DEFS)
+    unknown = [k for k in vars if k not in up.DEFS]
+    if unknown:
+        parser.error('Unknown variable(s) ' + ', '.join(unknown) + '.')
+
+    reader = iter(open_reader(args.input, args.input_format or guess_format(args.input), args.chunk))
+
+    # Variables out of the range of a lower precision stay in float64,
+    # judged by the first chunk, which is evaluated only once
+    dtypes = [np.dtype(args.dtype)] * len(vars)
+    first = next(reader, None)
+    if first is not None:
+        missing = [c for c in columns.values() if c not in first]
+        if missing:
+            parser.error('Column(s) ' + ', '.join(missing) + ' given in --map are not in the input.')
+        d = evaluate_chunk(first, columns, nrm, args.units)
+        if args.dtype != 'float64':
+            dtypes = list(uk.storage_dtypes(args.dtype, d, vars).values())
+            kept = [k for k, t in zip(vars, dtypes) if t != np.dtype(args.dtype)]
+            if kept:
+                print('Storing ' + ', '.join(kept) + ' in float64, out of the range of ' + args.dtype + '.',
+                      file=sys.stderr)
+
+    writer = open_writer(args.output, args.output_format or guess_format(args.output), vars, dtypes)
+    report = uk.PrecisionReport(args.dtype) if args.precision_report else None
+    try:
+        if first is not None:
+            write_chunk(writer, d, len(next(iter(first.values()))), vars, dtypes, report)
+        evaluate_stream(reader, writer, vars, args.units, columns, nrm, dtypes, report)
+    finally:
+        writer.close()
+    if report is not None:
+        report.print_table(sys.stderr)
+    return 0
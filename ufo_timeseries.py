@@ -0,0 +1,175 @@
+# Time-dependent outflow histories.
+#
+# Every UfoParams input parameter can be constant, an array over the time
+# steps (e.g. a tabulated light curve), or a callable of time (e.g. a
+# flickering duty cycle). All variables are evaluated lazily, block by
+# block of time steps, with the fused kernel into one set of reused
+# buffers, so memory use does not depend on the number of steps.
+#
+# Outputs that do not depend on time-varying inputs, the outflow area and
+# the ambient medium, are calculated once and filled into every block.
+#
+#   ts = TimeSeries(n=10**7, dt=1.e-3, power=lambda t: 1.e44 * (1. + np.sin(t)))
+#   for t, out in ts.blocks(units='cgs'):
+#       ... out['pres'], out['dens'] ...
+
+from collections import OrderedDict
+
+import numpy as np
+
+import ufo_kernels as uk
+
+# Inputs the time-invariant outputs depend on
+AMBIENT_INPUTS = ('dens_ambient', 'temp_ambient', 'gamma')
+GEOMETRY_INPUTS = ('angle', 'rufo')
+
+
+class TimeSeries():
+    """
+    UfoParams variables over a sequence of time steps.
+    """
+
+    def __init__(self, t=None, n=None, t0=0., dt=1., norm=None, block=16384, **inputs):
+        """
+        t               Times of the steps, 1d array. Default t0 + dt * i
+                        for the n steps i, generated per block.
+        n               Number of steps, if t is not given.
+        t0, dt          Time of the first step and time step.
+        norm            Normalization of code units. Default UfoParams'.
+        block           Number of time steps per block.
+        inputs          UfoParams input parameters, in the units UfoParams
+                        takes them. Each is a scalar, a 1d array with one
+                        value per step, or a callable taking a 1d array of
+                        times (in the units of t) and returning values for
+                        them. Missing parameters take the UfoParams defaults.
+        """
+        if t is not None:
+            t = np.asarray(t, dtype=float)
+            if t.ndim != 1:
+                raise ValueError('Times must be one dimensional.')
+            n = t.size
+        elif n is None:
+            raise ValueError('Either the times t or the number of steps n must be given.')
+        self.t = t
+        self.n = n
+        self.t0 = t0
+        self.dt = dt
+
+        self.kernel = uk.Kernel(norm, block)
+        self.block = block
+
+        # Sort inputs into constants, arrays over steps, and callables
+        self.constant = {}
+        self.arrays = {}
+        self.functions = {}
+        for k, v in inputs.items():
+            if k not in uk.INPUTS:
+                raise ValueError('Error, Unknown parameter ' + k + '.')
+            if callable(v):
+                self.functions[k] = v
+            elif np.ndim(v) == 0:
+                self.constant[k] = float(v)
+            else:
+                v = np.asarray(v, dtype=float)
+                if v.ndim != 1 or v.size != n:
+                    raise ValueError('Input parameter ' + k + ' must be scalar or have one value per step.')
+                self.arrays[k] = v
+        for k in uk.INPUTS:
+            if k not in inputs:
+                self.constant[k] = float(uk.DEFAULTS[k])
+
+        # Time-invariant outputs, evaluated once
+        self.const = {}
+        names = ()
+        if all(k in self.constant for k in AMBIENT_INPUTS): names += uk.AMBIENT
+        if all(k in self.constant for k in GEOMETRY_INPUTS): names += uk.GEOMETRY
+        if names:
+            out = self.kernel.evaluate(units='code', **self.constant)
+            self.const = dict((k, float(out[k][0])) for k in names)
+
+    def __len__(self):
+        return self.n
+
+    def times(self, start, stop):
+        """
+        Times of steps start to stop.
+        """
+        if self.t is not None:
+            return self.t[start:stop]
+        return self.t0 + self.dt * np.arange(start, stop, dtype=float)
+
+    def inputs(self, start, stop):
+        """
+        Dictionary of the input parameters of steps start to stop,
+        scalars for the constant ones.
+        """
+        t = self.times(start, stop)
+        params = dict((k, np.asarray(v)) for k, v in self.constant.items())
+        for k, v in self.arrays.items():
+            params[k] = v[start:stop]
+        for k, f in self.functions.items():
+            params[k] = np.broadcast_to(np.asarray(f(t), dtype=float), t.shape)
+        return t, params
+
+    def blocks(self, units='code', dtype=float, start=0, stop=None):
+        """
+        Generator evaluating steps start to stop block by block. Yields
+        the times of the block and an OrderedDict of all variables for
+        them. The arrays are views on buffers that are overwritten by
+        the next block; copy what needs to be kept.
+        """
+        if stop is None: stop = self.n
+        k = self.kernel
+        buf = k.new_output(min(self.block, max(stop - start, 0)), dtype)
+        work = k._default_work(buf)
+        for i0 in range(start, stop, self.block):
+            i1 = min(i0 + self.block, stop)
+            t, params = self.inputs(i0, i1)
+            o = OrderedDict((name, v[:i1 - i0]) for name, v in buf.items())
+            k.evaluate_block(params, o, slice(0, i1 - i0), units, work, const=self.const)
+            yield t, o
+
+    def evaluate(self, units='code', dtype=float, start=0, stop=None):
+        """
+        All variables of steps start to stop, as one OrderedDict of arrays.
+        """
+        if stop is None: stop = self.n
+        out = self.kernel.new_output(stop - start, dtype)
+        for i0, (t, o) in zip(range(0, stop - start, self.block), self.blocks(units, dtype, start, stop)):
+            for name, v in o.items():
+                out[name][i0:i0 + len(t)] = v
+        return out
+
+    def columns(self, vars, dtype=float, time=True):
+        """
+        OrderedDict of the column names written by write() to their
+        types, the time in float64 and vars in dtype. Open the writer
+        with them, e.g. open_writer(path, fmt, list(cols), cols).
+        """
+        cols = OrderedDict([('time', np.dtype(np.float64))] if time else [])
+        cols.update((name, np.dtype(dtype)) for name in vars)
+        return cols
+
+    def write(self, writer, vars, units='cgs', dtype=float, time=True):
+        """
+        Write variables vars of all steps block by block with writer,
+        e.g. from ufo_stream.open_writer(). The first column is the time if
+        time is True. The variables are calculated in float64 and rounded
+        to dtype, values out of its range raise OverflowError. The time is
+        kept in float64, as lower precision types cannot resolve small
+        steps at late times, so the writer must store it as float64 (see
+        columns()). Returns the number of steps written.
+        """
+        if time and np.dtype(writer.dtypes[0]).itemsize < 8:
+            raise ValueError('Error, the writer must store the time as float64, see TimeSeries.columns().')
+        dtype = np.dtype(dtype)
+        cols = len(vars) + (1 if time else 0)
+        for t, o in self.blocks(units):
+            data = np.empty((len(t), cols), dtype=np.float64)
+            if time: data[:, 0] = t
+            for i, name in enumerate(vars):
+                if not uk.in_range(o[name], dtype):
+                    raise OverflowError('Error, values of ' + name + ' are out of the range of ' + dtype.name + '.')
+                data[:, i + cols - len(vars)] = o[name].astype(dtype)
+            writer.write(data)
+        return self.n